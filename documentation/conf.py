@@ -16,6 +16,7 @@
 # documentation root, use os.path.abspath to make it absolute, like shown here.
 
 # Append the documentation directory to the path, so we can import variables
+# and the substitutions extension
 import os
 import sys
 sys.path.append(os.path.dirname(__file__))
@@ -38,7 +39,8 @@ extensions = [
     'sphinx.ext.autosectionlabel',
     'sphinx_rtd_theme',
     'sphinx_copybutton',
-    'sphinx_substitution_extensions'
+    'sphinx_substitution_extensions',
+    'substitutions'
 ]
 
 # Add any paths that contain templates here, relative to this directory.
@@ -100,4 +102,4 @@ copybutton_copy_empty_lines = False
 copybutton_line_continuation_character = "\\"
 
 import variables
-rst_prolog = variables.generate_rst_prolog()
+substitution_definitions = variables.generate_substitutions()
@@ -0,0 +1,154 @@
+# Copyright (c) 2022, Arm Limited.
+#
+# SPDX-License-Identifier: MIT
+
+# Sphinx extension that defines, at the start of each document, only the
+# substitutions and hyperlink targets that the document references.
+#
+# Unlike the rst_prolog, which is parsed in full at the start of every
+# document, the definitions are looked up by name in an index of the
+# "substitution_definitions" configuration value: a dictionary mapping each
+# substitution name to the reStructuredText that defines it (and its hyperlink
+# target, for links), as generated by variables.py.
+#
+# Files included with the "include" directive are parsed as part of the
+# including document, so the references within them are looked up as well.
+
+import os
+import re
+
+from sphinx.parsers import RSTParser
+from sphinx.util.rst import append_epilog, prepend_prolog
+
+# References to substitutions ("|name|"), using a lookahead so that overlapping
+# candidates such as the cells of a table row "| |name| |" are all found
+SUBSTITUTION_REFERENCE_REGEX = re.compile(r"(?=\|([^|\n]+)\|)")
+
+# References to hyperlink targets ("`name`_" or "name_")
+HYPERLINK_REFERENCE_REGEX = re.compile(
+    r"`([^`]+)`__?|(?<![\w`|])(\w[\w.+-]*?)__?(?!\w)")
+
+# Include directives, capturing the path of the included file
+INCLUDE_DIRECTIVE_REGEX = re.compile(
+    r"^[ \t]*\.\.[ \t]+include::[ \t]*(\S.*?)\s*$", re.MULTILINE)
+
+# Index of the definitions, by normalized substitution and target name
+definitions_index = {}
+
+
+def normalize_name(name):
+    """ Normalize a substitution or target name in the same way as docutils,
+        which matches names case-insensitively if there is no exact match. """
+
+    return " ".join(name.lower().split())
+
+
+def get_referenced_names(text):
+    """ Return the normalized names of the substitutions and hyperlink targets
+        referenced within text. """
+
+    names = set(SUBSTITUTION_REFERENCE_REGEX.findall(text))
+    for quoted_name, name in HYPERLINK_REFERENCE_REGEX.findall(text):
+        names.add(quoted_name or name)
+
+    return set(normalize_name(name) for name in names)
+
+
+def get_included_text(text, source, srcdir):
+    """ Return the text of the files included by text, which was read from
+        the file at source, including the text of the files that those
+        include in turn. Paths are resolved in the same way as Sphinx, which
+        treats absolute paths as relative to srcdir. Standard docutils
+        includes ("<name>") and files that cannot be read are skipped, as the
+        include directive reports those itself. """
+
+    included = []
+    seen = set()
+    pending = [(text, source)]
+
+    while pending:
+        text, source = pending.pop()
+        for path in INCLUDE_DIRECTIVE_REGEX.findall(text):
+            if path.startswith("<") and path.endswith(">"):
+                continue
+
+            if path.startswith("/"):
+                path = os.path.join(srcdir, path.lstrip("/"))
+            else:
+                path = os.path.join(os.path.dirname(source), path)
+
+            path = os.path.normpath(path)
+            if path in seen:
+                continue
+            seen.add(path)
+
+            try:
+                with open(path, encoding="utf-8") as f:
+                    included_text = f.read()
+            except (OSError, UnicodeDecodeError):
+                continue
+
+            included.append(included_text)
+            pending.append((included_text, path))
+
+    return "\n".join(included)
+
+
+def get_referenced_definitions(text):
+    """ Return the definitions of the substitutions and hyperlink targets
+        referenced within text, including any referenced by those
+        definitions. """
+
+    definitions = []
+    found = set()
+    pending = [text]
+
+    while pending:
+        for name in get_referenced_names(pending.pop()):
+            definition = definitions_index.get(name)
+            if definition is not None and definition not in found:
+                found.add(definition)
+                definitions.append(definition)
+                pending.append(definition)
+
+    return definitions
+
+
+class SubstitutionsParser(RSTParser):
+    """ reStructuredText parser which adds the definitions of the referenced
+        substitutions to the rst_prolog of each document. """
+
+    def decorate(self, content):
+        text = "\n".join(content)
+        if content:
+            text += "\n" + get_included_text(text, content.source(0),
+                                             self.env.srcdir)
+
+        definitions = get_referenced_definitions(text)
+
+        prolog = "\n".join(filter(None, [self.config.rst_prolog]
+                                  + definitions))
+
+        prepend_prolog(content, prolog)
+        append_epilog(content, self.config.rst_epilog)
+
+
+def build_definitions_index(app, config):
+
+    definitions_index.clear()
+    for name, definition in config.substitution_definitions.items():
+        definitions_index[normalize_name(name)] = definition
+
+
+def setup(app):
+
+    # Documents are read again whenever the definitions change
+    app.add_config_value("substitution_definitions", {}, "env")
+    app.add_source_parser(SubstitutionsParser, override=True)
+    app.connect("config-inited", build_definitions_index)
+
+    return {
+        "version": "1.0",
+        "parallel_read_safe": True,
+        "parallel_write_safe": True,
+    }
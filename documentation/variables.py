@@ -3,8 +3,11 @@
 # SPDX-License-Identifier: MIT
 
 # This file centralizes the variables and links used throughout the EWAOL
-# documentation. The dictionaries are converted to a single string that is used
-# as the rst_prolog (see the Sphinx Configuration documentation at
+# documentation. The dictionaries are converted to a dictionary of substitution
+# definitions, of which the substitutions.py Sphinx extension adds only those
+# referenced by a document to the start of that document. They can also be
+# converted to a single string for use as the rst_prolog (see the Sphinx
+# Configuration documentation at
 # [inclusivity-exception]
 # https://www.sphinx-doc.org/en/master/usage/configuration.html for more info).
 
@@ -131,9 +134,9 @@ def generate_replacement(key, value):
   replacement = f".. |{key}| replace:: {value}"
   return f"{replacement}"
 
-def generate_rst_prolog():
+def generate_substitutions():
 
-  rst_prolog = ""
+  substitutions = {}
 
   for variables_group in [general_links,
                           layer_definitions,
@@ -142,8 +145,9 @@ def generate_rst_prolog():
 
     for key, value in variables_group.items():
       if key.startswith("link:"):
-        rst_prolog += generate_link(key.split("link:")[1], value) + "\n"
+        key = key.split("link:")[1]
+        substitutions[key] = generate_link(key, value)
       else:
-        rst_prolog += generate_replacement(key, value) + "\n"
+        substitutions[key] = generate_replacement(key, value)
 
-  return rst_prolog
+  return substitutions
@@ -5,9 +5,11 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import json
 import os
 import pathlib
 import logging
+import re
 import subprocess
 import shutil
 import sys
@@ -18,6 +20,18 @@ sys.path.append(path)
 
 import modules_virtual_env  # noqa: E402
 
+# Warnings and errors written by sphinx-build to its warning file (-w),
+# optionally located by document and line number. For example:
+#   /path/to/document.rst:12: WARNING: undefined label: ...
+# On its standard output, a warning may follow the progress text on the same
+# line, so the document is only parsed from the warning file.
+SPHINX_WARNING_REGEX = re.compile(
+    r"^(?:(?P<document>.*?):(?:(?P<line>\d+):)? )?"
+    r"(?P<type>WARNING|ERROR|SEVERE|CRITICAL): (?P<message>.*)$")
+
+# ANSI color codes, in case sphinx-build colors its output
+ANSI_ESCAPE_REGEX = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
+
 
 def generate_venv_script_args_from_opts(opts):
     """ In order to call this script from the virtual environment, convert the
@@ -34,8 +48,10 @@ def generate_venv_script_args_from_opts(opts):
         elif opt == "no_venv":
             # set the no_venv argument
             arg = opt
-        elif value is None:
+        elif value is None or value is False:
             continue
+        elif value is True:
+            arg = opt
         else:
             arg = f"{opt}={value}"
 
@@ -132,6 +148,35 @@ def parse_options(logger):
                         help=("Set the output directory (Default:"
                               f" {output_dir_default})."))
 
+    parser.add_argument("--jobs",
+                        default="auto",
+                        help=("Set the number of parallel processes used by"
+                              " sphinx to read and write the documents, or"
+                              " 'auto' for the number of CPUs (Default:"
+                              " auto)."))
+
+    parser.add_argument("--incremental",
+                        action="store_true",
+                        default=False,
+                        help=("Only read the documents that have changed"
+                              " since the last build, and only write the"
+                              " outputs that have changed, rather than"
+                              " rebuilding from scratch (Default: False)."))
+
+    doctree_dir_default = "{output_dir}/.doctrees"
+    parser.add_argument("--doctree_dir",
+                        default=doctree_dir_default,
+                        help=("Set the directory in which the doctrees and"
+                              " the build environment are cached between"
+                              " incremental builds (Default:"
+                              f" {doctree_dir_default})."))
+
+    parser.add_argument("--warnings_file",
+                        help=("Write the warnings and errors reported by"
+                              " sphinx to the given file, as a JSON list of"
+                              " objects with the 'document', 'line', 'type'"
+                              " and 'message' of each (Default: None)."))
+
     opts = parser.parse_args()
 
     if opts.venv is not None and opts.no_venv is True:
@@ -144,6 +189,9 @@ def parse_options(logger):
     opts.project_root = pathlib.Path(opts.project_root).resolve()
     opts.documentation_dir = resolve_path(opts.documentation_dir, opts)
     opts.output_dir = resolve_path(opts.output_dir, opts)
+    opts.doctree_dir = resolve_path(opts.doctree_dir, opts)
+    if opts.warnings_file is not None:
+        opts.warnings_file = resolve_path(opts.warnings_file, opts)
     opts.requirements = resolve_path(opts.requirements, opts)
 
     return opts
@@ -170,6 +218,72 @@ def parse_requirements_file(requirements_file):
     return requirements
 
 
+def parse_sphinx_warning(line):
+    """ Return a dictionary describing the warning or error given by a line of
+        sphinx-build output, or None if the line is not a warning or error.
+        """
+
+    match = SPHINX_WARNING_REGEX.match(line)
+    if match is None:
+        return None
+
+    warning = match.groupdict()
+    if warning["line"] is not None:
+        warning["line"] = int(warning["line"])
+
+    return warning
+
+
+def read_sphinx_warnings(warning_file):
+    """ Return the list of warnings and errors written by sphinx-build to its
+        warning file. Lines which are not a warning or error continue the
+        message of the previous one. """
+
+    warnings = []
+    with open(warning_file, "r", errors="replace") as f:
+        for line in f:
+            line = ANSI_ESCAPE_REGEX.sub("", line).rstrip()
+
+            warning = parse_sphinx_warning(line)
+            if warning is not None:
+                warnings.append(warning)
+            elif line and warnings:
+                warnings[-1]["message"] += f"\n{line}"
+
+    return warnings
+
+
+def run_sphinx_build(logger, cmd):
+    """ Run the sphinx-build command, logging its output line by line as it
+        is produced. Returns the return code and the list of warnings and
+        errors, read from the warning file written by sphinx-build. """
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        warning_file = os.path.join(tmp_dir, "warnings.log")
+
+        process = subprocess.Popen(f"{cmd} -w {warning_file}",
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   shell=True,
+                                   universal_newlines=True)
+
+        for line in process.stdout:
+            line = line.rstrip()
+
+            if SPHINX_WARNING_REGEX.search(ANSI_ESCAPE_REGEX.sub("", line)):
+                logger.warning(line)
+            elif line:
+                logger.info(line)
+
+        process.wait()
+
+        warnings = []
+        if os.path.isfile(warning_file):
+            warnings = read_sphinx_warnings(warning_file)
+
+    return process.returncode, warnings
+
+
 def main(logger, opts):
     exit_code = 0
 
@@ -193,22 +307,38 @@ def main(logger, opts):
             logger.error(f"Could not find sphinx-build executable")
             exit(1)
 
-        # cleaning and building the documentation
-        cmd = (f"{sphinx_path} -a -E -W --keep-going -b html "
-               f"{opts.documentation_dir} {opts.output_dir}")
+        if opts.incremental:
+            # building only the documents and outputs that have changed
+            build_args = ""
+        else:
+            # cleaning and building the documentation
+            build_args = "-a -E "
 
-        process = subprocess.Popen(cmd,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT,
-                                   shell=True,
-                                   universal_newlines=True)
+        cmd = (f"{sphinx_path} {build_args}-j {opts.jobs}"
+               f" -d {opts.doctree_dir} -W --keep-going -b html"
+               f" {opts.documentation_dir} {opts.output_dir}")
+
+        logger.debug(f"Running '{cmd}'")
+        exit_code, warnings = run_sphinx_build(logger, cmd)
 
-        (cmdout, cmderr) = process.communicate()
-        exit_code = process.returncode
+        if opts.warnings_file is not None:
+            opts.warnings_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(opts.warnings_file, "w") as f:
+                json.dump(warnings, f, indent=2)
 
         if exit_code != 0:
             logger.error("Error while building the documentation using"
-                         f" '{cmd}' : {cmdout}")
+                         f" '{cmd}' ({len(warnings)} warnings or errors)")
+
+            # Warnings are only reported when a document is read, so discard
+            # the cached environment to read every document again in the
+            # next incremental build, rather than skip any that failed
+            if opts.incremental:
+                environment = opts.doctree_dir / "environment.pickle"
+                if environment.is_file():
+                    environment.unlink()
+                    logger.debug(f"Deleted the build environment cache:"
+                                 f" {environment}")
         else:
             logger.info(f"Files generated in {opts.output_dir}")
 
@@ -5,20 +5,45 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import atexit
+import codecs
+import collections
+import concurrent.futures
 import copy
 import enum
+import errno
+import fcntl
+import fnmatch
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import multiprocessing
+import multiprocessing.connection
 import os
 import pathlib
 import platform
 import pty
+import queue
 import re
 import shlex
+import shutil
 import signal
+import stat
 import subprocess
 import sys
 import tarfile
+import tempfile
+import threading
 import time
 import yaml
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 # Any function with external effects should be called with this methods so it
@@ -51,6 +76,12 @@ class RunSystem():
         self.env_vars = {}
         self.kas_files = []
 
+        # Whether the kas command is attached to the terminal
+        self.interactive = True
+
+        # BuildProgress updated from the output of the kas command, if any
+        self.progress = None
+
     def add_path(self, key, path, access="rw", env_var=None):
         if isinstance(path, str):
             path = pathlib.Path(path)
@@ -95,42 +126,84 @@ class RunSystem():
 
         return f"kas {self.kas_arguments} {kas_files_string}"
 
+    # Maximum number of bytes read from the output of the kas command at once
+    PTY_READ_SIZE = 64 * 1024
+
+    # Control sequences in the output of the kas command which are cleaned up
+    # before writing it to the log file, as the output from the kas command
+    # (e.g. running the container) may be encoded differently than the
+    # kas-runner output, and writing both to file results in garbled text.
+    # Line endings including a carriage return, backspace and/or escape are
+    # replaced by a newline (in order), and ANSI color codes are removed from
+    # the file (but kept in the terminal).
+    # The replacements are not combined into a single re.sub, as it would need
+    # a Python callback for each match to choose between the newline and the
+    # empty replacement, which is several times slower than the str.replace
+    # calls and the one re.sub with a constant replacement.
+    LOG_LINE_ENDINGS = [
+        ("\r\n", "\n"),  # CRCRLF
+        ("\x08\n", "\n"),  # Backspace + NL
+        ("\x1b\n", "\n"),  # Escape + NL
+        ("\r", "\n"),  # Carriage Return
+    ]
+    LOG_COLOR_PATTERN = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
+
+    # Control sequences which may be incomplete at the end of the output read
+    # so far, so are cleaned up along with the next output
+    LOG_INCOMPLETE_PATTERN = re.compile(
+        r"(?:(?:\x1b?\x08|\x1b)\r?|\r|\x1b\[[0-?]*[ -/]*)\Z")
+
     def _run_interactive_pty(self, command):
 
-        color_patterns = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
+        log_opt = sys.stdout.log_opt
+        log_writer = None
+        if log_opt == LogOpt.TO_BOTH or log_opt == LogOpt.TO_FILE:
+            log_writer = LogFileWriter(sys.tee.log_file)
+            log_writer.start()
+
+        # Multi-byte characters may be split between reads
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
+
+        def clean_output(output):
+            for sequence, replacement in self.LOG_LINE_ENDINGS:
+                output = output.replace(sequence, replacement)
+            return self.LOG_COLOR_PATTERN.sub("", output)
 
         def capture_output(file_descriptor):
-            data = os.read(file_descriptor, 1024)
-
-            log_opt = sys.stdout.log_opt
-            if log_opt == LogOpt.TO_BOTH or log_opt == LogOpt.TO_FILE:
-
-                # Clean up the output, as the output from the kas command (e.g.
-                # running the container) may be encoded differently than the
-                # kas-runner output, and writing both to file results in
-                # garbled text.
-                output = data.replace(b"\x0d\x0a", b"\x0a")  # CRCRLF
-                output = output.replace(b"\x08\x0a", b"\x0a")  # Backspace + NL
-                output = output.replace(b"\x1b\x0a", b"\x0a")  # Escape + NL
-                output = output.replace(b"\x0d", b"\x0a")  # Carriage Return
-
-                # Remove ANSI color codes from file (but keep them in terminal)
-                output_str = output.decode()
-                output_str = color_patterns.sub("", output_str)
-                sys.tee.log_file.write(output_str)
-                sys.tee.log_file.flush()
-
-                if log_opt == LogOpt.TO_FILE:
-                    # Return NULL character as empty output is considered EOF
-                    return b"\x00"
-                else:
-                    # Also return data for output to terminal
-                    return data
+            nonlocal pending
+
+            data = os.read(file_descriptor, self.PTY_READ_SIZE)
+
+            if (log_writer is not None or self.progress is not None) and data:
+                output = pending + decoder.decode(data)
+
+                incomplete = self.LOG_INCOMPLETE_PATTERN.search(
+                    output, max(len(output) - 64, 0))
+                split = incomplete.start() if incomplete else len(output)
+                pending = output[split:]
 
+                if log_writer is not None:
+                    log_writer.write(clean_output(output[:split]))
+                if self.progress is not None:
+                    self.progress.update(output[:split])
+
+            if log_opt == LogOpt.TO_FILE and data:
+                # Return NULL character as empty output is considered EOF
+                return b"\x00"
             else:
+                # Also return data for output to terminal
                 return data
 
-        returncode = pty.spawn(shlex.split(command), capture_output)
+        try:
+            returncode = pty.spawn(shlex.split(command), capture_output)
+        finally:
+            output = pending + decoder.decode(b"", final=True)
+            if log_writer is not None:
+                log_writer.write(clean_output(output))
+                log_writer.close()
+            if self.progress is not None:
+                self.progress.update(output)
 
         if returncode > 0:
             print((f"Error: command: \n{command}\n"
@@ -148,7 +221,10 @@ class RunSystem():
                                 shell=True)
 
         for next_line in proc.stdout:
-            print(next_line.decode(), end='')
+            next_line = next_line.decode()
+            print(next_line, end='')
+            if self.progress is not None:
+                self.progress.update(next_line)
 
         proc.wait()
 
@@ -163,11 +239,20 @@ class RunSystem():
         """ Internal run function that produces side effects so should be
             called using run_external_effect. """
 
-        if ("shell" in self.kas_arguments and
-                any(x in self.kas_arguments for x in ["-c", "--command"])):
-            return self._run_subprocess(command)
+        if self.progress is not None:
+            self.progress.start()
+
+        if (not self.interactive or
+                ("shell" in self.kas_arguments and
+                 any(x in self.kas_arguments for x in ["-c", "--command"]))):
+            retcode = self._run_subprocess(command)
         else:
-            return self._run_interactive_pty(command)
+            retcode = self._run_interactive_pty(command)
+
+        if self.progress is not None:
+            self.progress.finish(retcode)
+
+        return retcode
 
     def run(self):
         """ Run command as a subprocess """
@@ -195,7 +280,9 @@ class ContainerEngine(RunSystem):
 
         super().__init__(project_root, kas_arguments)
 
-        self.CONTAINER_NAME = f"kas_build.{int(time.time())}"
+        # Include the process ID, so that containers started concurrently by
+        # separate runs within the same second have distinct names
+        self.CONTAINER_NAME = f"kas_build.{int(time.time())}.{os.getpid()}"
         self.engine_args = [f"--rm --name {self.CONTAINER_NAME}"]
         self.container_image = image
         self.container_image_version = image_version
@@ -224,7 +311,9 @@ class ContainerEngine(RunSystem):
         if env_var:
             self.add_env(env_var, path_container)
 
-    def build_command(self):
+    def add_path_and_env_args(self):
+        """ Add the container engine run arguments for the paths and
+            environment variables """
         key_paths_container = dict(
             ((key, f"/{key}") for key in self.key_paths))
 
@@ -236,6 +325,9 @@ class ContainerEngine(RunSystem):
         for env_key, value in self.env_vars.items():
             self.add_env_arg(env_key, value.format_map(key_paths_container))
 
+    def build_command(self):
+        self.add_path_and_env_args()
+
         kas_files_string = self.get_kas_files_string()
 
         return (f"docker run {' '.join(self.engine_args)}"
@@ -294,6 +386,181 @@ class ContainerEngine(RunSystem):
         return retcode
 
 
+class SessionContainerEngine(ContainerEngine):
+    """ Class used to configure and run kas within a persistent, named
+        container. The container is started by the first run of the session,
+        and later runs execute their kas command in it via 'docker exec', so
+        they do not pay for the container start-up or the bitbake server
+        start-up each time. """
+
+    # Label storing the digest of the session container's configuration
+    CONFIG_LABEL = "kas-runner.session-config"
+
+    # User created within the kas container image to run kas
+    CONTAINER_USER = "builder"
+
+    # Seconds to wait for the session container to be ready for use
+    START_TIMEOUT = 60
+
+    def __init__(self, project_root, kas_arguments, image, image_version,
+                 session):
+
+        super().__init__(project_root, kas_arguments, image, image_version)
+
+        self.CONTAINER_NAME = self.get_container_name(session)
+        self.engine_args = [f"--detach --name {self.CONTAINER_NAME}"]
+        self.start_command = None
+        self.config_digest = None
+
+        # Keep the bitbake server running between commands of the session.
+        # kas only forwards it to bitbake as it is listed in the env section
+        # of the kas configs
+        self.add_env("BB_SERVER_TIMEOUT", -1)
+
+    @staticmethod
+    def get_container_name(session):
+        return f"kas_session.{session}"
+
+    def build_command(self):
+        """ Build the command to start the session container, which runs until
+            stopped, and return the command to run kas within it """
+
+        self.add_path_and_env_args()
+
+        container_args = (f"{' '.join(self.engine_args)}"
+                          f" {self.container_image}:"
+                          f"{self.container_image_version}")
+
+        # Any change to the volumes, environment or image of the container
+        # requires a new session
+        self.config_digest = hashlib.sha256(
+            container_args.encode()).hexdigest()
+
+        self.start_command = (f"docker run --label"
+                              f" {self.CONFIG_LABEL}={self.config_digest}"
+                              f" {container_args} sleep infinity")
+        print(f"Session container start command:\n{self.start_command}")
+
+        exec_args = f"--user {self.CONTAINER_USER}"
+        if ("shell" in self.kas_arguments and
+                not any(x in self.kas_arguments for x in ["-c", "--command"])):
+            exec_args += " -it"
+
+        kas_files_string = self.get_kas_files_string()
+
+        return (f"docker exec {exec_args} {self.CONTAINER_NAME}"
+                f" kas {self.kas_arguments} {kas_files_string}")
+
+    def _inspect_session(self):
+        """ Return the configuration digest label and running state of the
+            session container, or None if it does not exist """
+
+        inspect_cmd = ["docker", "inspect", "--format",
+                       (f"{{{{index .Config.Labels \"{self.CONFIG_LABEL}\"}}}}"
+                        " {{.State.Running}}"),
+                       self.CONTAINER_NAME]
+        proc = subprocess.run(inspect_cmd,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL,
+                              universal_newlines=True)
+
+        if proc.returncode != 0:
+            return None
+
+        config_digest, running = proc.stdout.strip().rsplit(" ", 1)
+        return config_digest, running == "true"
+
+    def _wait_for_session(self):
+        """ Wait until the container's entrypoint has created the user that
+            runs kas """
+
+        wait_cmd = ["docker", "exec", self.CONTAINER_NAME,
+                    "id", "-u", self.CONTAINER_USER]
+        deadline = time.monotonic() + self.START_TIMEOUT
+
+        while time.monotonic() < deadline:
+            proc = subprocess.run(wait_cmd,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+            if proc.returncode == 0:
+                return True
+            time.sleep(0.5)
+
+        return False
+
+    def _start_session(self):
+        """ Start the session container if it is not already running, and
+            check that a running container has the same configuration """
+
+        session = self._inspect_session()
+
+        if session is not None and session[0] != self.config_digest:
+            print((f"Error: the session container {self.CONTAINER_NAME} was"
+                   " started with a different configuration. Stop it using"
+                   " --session_stop before changing the session's"
+                   " configuration."), file=sys.tee)
+            return False
+
+        if session is None:
+            print(f"Starting session container {self.CONTAINER_NAME}",
+                  file=sys.tee)
+            start_cmd = self.start_command
+        elif not session[1]:
+            print(f"Restarting session container {self.CONTAINER_NAME}",
+                  file=sys.tee)
+            start_cmd = f"docker start {self.CONTAINER_NAME}"
+        else:
+            print(f"Reusing session container {self.CONTAINER_NAME}",
+                  file=sys.tee)
+            return True
+
+        proc = subprocess.run(start_cmd,
+                              stdout=subprocess.DEVNULL,
+                              shell=True)
+        if proc.returncode != 0:
+            print((f"Error: command: \n{start_cmd}\n"
+                   f"Failed with return code {proc.returncode}"),
+                  file=sys.tee)
+            return False
+
+        if not self._wait_for_session():
+            print((f"Error: the session container {self.CONTAINER_NAME} was"
+                   f" not ready within {self.START_TIMEOUT} seconds"),
+                  file=sys.tee)
+            return False
+
+        return True
+
+    def _run(self, command):
+        """ Subset of the run function that produces side effects so should
+            be called using run_external_effect. The session container is
+            left running when the command completes or is interrupted. """
+
+        if not self._start_session():
+            return 1
+
+        return RunSystem._run(self, command)
+
+    @classmethod
+    def stop(cls, session):
+        """ Stop and remove the session container. Produces side effects so
+            should be called using run_external_effect. """
+
+        stop_cmd = ["docker", "rm", "--force", cls.get_container_name(session)]
+        proc = subprocess.run(stop_cmd,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE,
+                              universal_newlines=True)
+
+        if proc.returncode != 0:
+            print((f"Error: failed to stop the session container via:\n"
+                   f"{' '.join(stop_cmd)}\n{proc.stderr.strip()}"),
+                  file=sys.tee)
+            return 1
+
+        return 0
+
+
 # Create a directory only if it doesn't already exist
 def mk_newdir(path):
     if not os.path.exists(path):
@@ -399,6 +666,9 @@ class RunnerSettings():
         self.set_to_default()
         self.resolved = False
 
+        # Name of the config within a config file, if loaded from one
+        self.name = None
+
     # Convert list of settings to a dictionary indexed by name.
     def setup_settings_details(self, settings_details):
         return {s.setting_name: s for s in settings_details}
@@ -491,6 +761,11 @@ def get_settings_details():
             value = value[0]
 
         if bool(value) is False:
+            # Stopping a session or collecting the garbage of the artifacts
+            # store does not require any kas config files
+            if (resolve_bool(config, config.session_stop) or
+                    resolve_bool(config, config.artifacts_store_gc)):
+                return []
             print(f"ERROR: No kasfiles specified.")
             raise RunnerResolveError()
 
@@ -528,9 +803,11 @@ def get_settings_details():
         """ For convenience, if the user has specified "shell" in the
             kas_arguments to be run in a container, make the container run as
             an interactive terminal process by appending "-it" to the
-            engine_arguments only if -c or --command are not passed"""
+            engine_arguments only if -c or --command are not passed. In a
+            session, "-it" is instead passed when running the kas command
+            within the session container"""
 
-        if config.containerize:
+        if config.containerize and not config.session:
 
             if ("shell" in config.kas_arguments and
                     not any(x in config.kas_arguments
@@ -539,6 +816,146 @@ def get_settings_details():
 
         return value
 
+    def resolve_artifacts_compression(config, value):
+        if value not in ARTIFACT_CODECS:
+            print(f"ERROR: Unsupported compression '{value}'. Expected one"
+                  f" of: {', '.join(ARTIFACT_CODECS)}")
+            raise RunnerResolveError()
+
+        if value == "zstd" and zstandard is None:
+            print("ERROR: zstd compression requires the 'zstandard' Python"
+                  " module")
+            raise RunnerResolveError()
+
+        return value
+
+    def resolve_artifacts_compression_level(config, value):
+        if value is None or value == "":
+            return None
+
+        levels = ARTIFACT_CODECS[config.artifacts_compression][2]
+        try:
+            value = int(value)
+        except ValueError:
+            value = None
+
+        if value not in levels:
+            print(f"ERROR: The {config.artifacts_compression} compression"
+                  f" level must be from {levels.start} to {levels.stop - 1}")
+            raise RunnerResolveError()
+
+        return value
+
+    def resolve_log_compression(config, value):
+        if value != "none" and value not in LOG_CODECS:
+            print(f"ERROR: Unsupported log compression '{value}'. Expected"
+                  f" one of: none, {', '.join(LOG_CODECS)}")
+            raise RunnerResolveError()
+
+        if value == "zstd" and zstandard is None:
+            print("ERROR: zstd compression requires the 'zstandard' Python"
+                  " module")
+            raise RunnerResolveError()
+
+        return value
+
+    def resolve_log_compression_level(config, value):
+        if value is None or value == "" or config.log_compression == "none":
+            return None
+
+        levels = LOG_CODECS[config.log_compression][2]
+        try:
+            value = int(value)
+        except ValueError:
+            value = None
+
+        if value not in levels:
+            print(f"ERROR: The {config.log_compression} log compression"
+                  f" level must be from {levels.start} to {levels.stop - 1}")
+            raise RunnerResolveError()
+
+        return value
+
+    def resolve_log_rotate_size(config, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            value = -1
+
+        if value < 0:
+            print("ERROR: The log rotation size must be a number of MiB, or 0"
+                  " to disable rotation")
+            raise RunnerResolveError()
+
+        return value
+
+    def resolve_progress_file(config, value):
+        if value is None or value == "":
+            return None
+
+        return resolve_config_reference_to_path(config, value)
+
+    def resolve_artifacts_store(config, value):
+        if value is None or value == "":
+            return None
+
+        return resolve_config_reference_to_path(config, value)
+
+    def resolve_artifacts_store_link(config, value):
+        if value not in ["hardlink", "reflink"]:
+            print(f"ERROR: Unsupported link type '{value}'. Expected"
+                  " 'hardlink' or 'reflink'")
+            raise RunnerResolveError()
+
+        return value
+
+    def resolve_artifacts_store_keep(config, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            value = -1
+
+        if value < 1:
+            print("ERROR: At least one manifest must be kept for each build")
+            raise RunnerResolveError()
+
+        return value
+
+    def resolve_artifacts_store_gc(config, value):
+        value = resolve_bool(config, value)
+
+        if value and config.artifacts_store is None:
+            print("ERROR: 'artifacts_store_gc' requires an 'artifacts_store'"
+                  " to collect.")
+            raise RunnerResolveError()
+
+        return value
+
+    def resolve_session(config, value):
+        if value is None or value == "":
+            return None
+
+        if not re.fullmatch(r"[a-zA-Z0-9][a-zA-Z0-9_.-]*", value):
+            print(f"ERROR: Invalid session name '{value}'. It may only"
+                  " contain alphanumeric characters, '_', '.' and '-'.")
+            raise RunnerResolveError()
+
+        if not config.containerize:
+            print("ERROR: A session can only be used when 'containerize' is"
+                  " enabled.")
+            raise RunnerResolveError()
+
+        return value
+
+    def resolve_session_stop(config, value):
+        value = resolve_bool(config, value)
+
+        if value and config.session is None:
+            print("ERROR: 'session_stop' requires a 'session' to stop.")
+            raise RunnerResolveError()
+
+        return value
+
     def resolve_build_dir_name(config, value):
         """ As build_dir_name is only used to define build_dir, it is
             incompatible with a user-supplied build_dir value.
@@ -570,7 +987,8 @@ def get_settings_details():
             (checking for None) in resolve_build_dir_name """
 
         if value is None or value == "":
-            return config.out_dir / config.build_dir_name
+            # build_dir_name is empty when only stopping a session
+            return config.out_dir / (config.build_dir_name or "")
 
         return value
 
@@ -715,6 +1133,55 @@ def get_settings_details():
             help=("Write output to the given log file as well as to stdout"
                   " (default: {default}).")),
 
+        RunnerSetting(
+            "log_compression",
+            metavar="CODEC",
+            default="none",
+            resolve_function=resolve_log_compression,
+            help=("Compression of the log file while it is written: 'none',"
+                  " 'gzip' or 'zstd' (requires the 'zstandard' Python"
+                  " module). The compressed log file is given the extension"
+                  " of the codec, and it and any rotated log files are"
+                  " indexed in the uncompressed file 'log_file'.index"
+                  " (default: {default}).")),
+
+        RunnerSetting(
+            "log_compression_level",
+            metavar="LEVEL",
+            resolve_function=resolve_log_compression_level,
+            help=("Compression level of the log file (default: 6 for gzip"
+                  " and 3 for zstd).")),
+
+        RunnerSetting(
+            "log_rotate_size",
+            metavar="MIB",
+            default=0,
+            resolve_function=resolve_log_rotate_size,
+            help=("Continue the log in a new numbered file (e.g."
+                  " build.log.001.gz) once it reaches the given size in"
+                  " MiB on disk, or never if 0. The rotated log files are"
+                  " kept, and indexed in 'log_file'.index"
+                  " (default: {default}).")),
+
+        RunnerSetting(
+            "status_file",
+            metavar="FILE",
+            resolve_function=resolve_progress_file,
+            help=("Write the progress of the bitbake tasks, their throughput"
+                  " and the estimated time to complete them, as parsed from"
+                  " the build output, to the given JSON file while building."
+                  " It may reference other settings, e.g."
+                  " '{{build_dir}}/status.json' (default: {default}).")),
+
+        RunnerSetting(
+            "metrics_file",
+            metavar="FILE",
+            resolve_function=resolve_progress_file,
+            help=("Write the same build progress as 'status_file' as"
+                  " Prometheus metrics to the given file, for the textfile"
+                  " collector of the node exporter (which requires the"
+                  " '.prom' extension) (default: {default}).")),
+
         RunnerSetting(
             "containerize",
             metavar="BOOL",
@@ -731,6 +1198,62 @@ def get_settings_details():
             help=("Archive and compress build artifacts, and deploy to"
                   " 'artifacts_dir' (default: {default}).")),
 
+        RunnerSetting(
+            "artifacts_compression",
+            metavar="CODEC",
+            default="gzip",
+            resolve_function=resolve_artifacts_compression,
+            help=("Compression of the deployed artifact archives: 'gzip',"
+                  " 'xz' or 'zstd' (requires the 'zstandard' Python module)."
+                  " Blocks of each archive are compressed in parallel"
+                  " (default: {default}).")),
+
+        RunnerSetting(
+            "artifacts_compression_level",
+            metavar="LEVEL",
+            resolve_function=resolve_artifacts_compression_level,
+            help=("Compression level of the deployed artifact archives"
+                  " (default: 9 for gzip, 6 for xz and 3 for zstd).")),
+
+        RunnerSetting(
+            "artifacts_store",
+            metavar="PATH",
+            resolve_function=resolve_artifacts_store,
+            help=("If 'deploy_artifacts' is enabled, deploy the artifacts"
+                  " into the content-addressed store at the given path,"
+                  " rather than as archives within"
+                  " 'artifacts_dir'. Each file is stored once, however many"
+                  " builds deploy it, and each deployment is a manifest"
+                  " directory of links to the stored files (default:"
+                  " {default}).")),
+
+        RunnerSetting(
+            "artifacts_store_link",
+            metavar="TYPE",
+            default="hardlink",
+            resolve_function=resolve_artifacts_store_link,
+            help=("Type of links from the manifests to the stored files:"
+                  " 'hardlink' or 'reflink', falling back to hardlinks where"
+                  " reflinks are not supported (default: {default}).")),
+
+        RunnerSetting(
+            "artifacts_store_keep",
+            metavar="N",
+            default=10,
+            resolve_function=resolve_artifacts_store_keep,
+            help=("Number of the most recent manifests of each build kept by"
+                  " 'artifacts_store_gc' (default: {default}).")),
+
+        RunnerSetting(
+            "artifacts_store_gc",
+            metavar="BOOL",
+            default=False,
+            resolve_function=resolve_artifacts_store_gc,
+            help=("Remove the old manifests from 'artifacts_store', and the"
+                  " files no longer in any manifest, without running a kas"
+                  " command. It should not be run while artifacts are being"
+                  " deployed to the store (default: {default}).")),
+
         RunnerSetting(
             "dry_run",
             metavar="BOOL",
@@ -739,6 +1262,24 @@ def get_settings_details():
             help=("Print all the variables, arguments and run commands but"
                   " don't execute anything with external effects (default:"
                   " {default})")),
+
+        RunnerSetting(
+            "session",
+            metavar="NAME",
+            resolve_function=resolve_session,
+            help=("Run the kas command within the persistent container of"
+                  " the named session, starting it if it is not running."
+                  " Later runs with the same session reuse the container"
+                  " and its bitbake server, so require the same"
+                  " configuration (default: {default}).")),
+
+        RunnerSetting(
+            "session_stop",
+            metavar="BOOL",
+            default=False,
+            resolve_function=resolve_session_stop,
+            help=("Stop and remove the container of the given 'session',"
+                  " without running a kas command (default: {default}).")),
     ]
 
     return settings_details
@@ -807,8 +1348,12 @@ def get_command_line_args(settings_details):
     parser.add_argument(
         "-c",
         "--config",
-        metavar="FILE",
-        help="Load script parameters from file (default: %(default)s).")
+        metavar="FILE[:CONFIGS]",
+        help=("Load script parameters from file (default: %(default)s). The"
+              " configs to build may be selected from the file as a comma"
+              " (,) separated list of config names or glob patterns, e.g."
+              " 'ci.yml:n1sdp-*' or 'ci.yml:*'. Otherwise, only the first"
+              " config in the file is built."))
 
     parser.add_argument(
         "-p",
@@ -819,6 +1364,26 @@ def get_command_line_args(settings_details):
               " the resulting value of the target parameter. Execution will"
               " stop once the value has been printed."))
 
+    parser.add_argument(
+        "--parallel",
+        metavar="N",
+        type=int,
+        default=1,
+        help=("Build up to N of the selected configs at the same time, each"
+              " given an equal share of 'number_threads' for both"
+              " BB_NUMBER_THREADS and PARALLEL_MAKE. The builds share the"
+              " sstate and downloads caches, and their output is prefixed"
+              " with their build directory name (default: %(default)s)."))
+
+    parser.add_argument(
+        "--build_base",
+        action="store_true",
+        help=("Before building the selected configs, build each set of"
+              " leading kas config files that several of them share, to"
+              " fill the shared sstate cache once. Configs are always built"
+              " after the selected configs whose kas config files they"
+              " extend."))
+
     # Add arguments for runner settings
     for runner_setting in settings_details:
         runner_setting.add_to_args(parser)
@@ -852,11 +1417,11 @@ def get_configs(default_config, args):
     config_names = dict()
 
     if args["config"]:
-        # 'config' is a string like "path/to/config_file.yml[:named_config]"
-        # check if named_config is specified
+        # 'config' is a string like "path/to/config_file.yml[:selector]"
+        # check if a selector of named configs is specified
         config_input = args["config"].split(":", maxsplit=1)
         config_file = config_input[0]
-        named_config = config_input[1] if len(config_input) == 2 else None
+        selector = config_input[1] if len(config_input) == 2 else None
 
         with open(config_file, "r") as yaml_file:
             try:
@@ -876,13 +1441,17 @@ def get_configs(default_config, args):
                     print(f"ERROR: No configs defined in config file")
                     exit(1)
 
-                if named_config is not None:
-                    selected_name = named_config
+                if selector is not None:
+                    selected_names = select_config_names(selector,
+                                                         config_names)
                 else:
-                    selected_name = next(iter(yaml_configs.keys()))
-                config_dict = yaml_configs[selected_name]
-                runner_configs.append(merge_configs(default_config,
-                                                    config_dict))
+                    selected_names = [next(iter(yaml_configs.keys()))]
+
+                for selected_name in selected_names:
+                    config = merge_configs(default_config,
+                                           yaml_configs[selected_name])
+                    config.name = selected_name
+                    runner_configs.append(config)
 
             except KeyError:
                 print(f"ERROR: Invalid configs {args['config']}")
@@ -913,49 +1482,717 @@ def get_configs(default_config, args):
     return (runner_configs, config_names)
 
 
+# Return the names of the configs selected from a config file, in the order
+# they are given by the selector: a comma (,) separated list of config names,
+# each of which may be a glob pattern matching several configs (e.g. 'n1sdp-*'
+# or '*'). Configs selected more than once are only returned once.
+def select_config_names(selector, config_names):
+    selected_names = []
+
+    for pattern in selector.split(","):
+        pattern = pattern.strip()
+        matches = fnmatch.filter(config_names, pattern)
+
+        if not matches:
+            print(f"ERROR: No configs matching '{pattern}' in the config"
+                  " file")
+            exit(1)
+
+        selected_names.extend(name for name in matches
+                              if name not in selected_names)
+
+    return selected_names
+
+
+# Compression codecs for the artifact archives, with the extension of their
+# archives, their default compression level, the range of valid levels and a
+# function compressing a block of data into an independent member of the
+# format. Members of each format can be concatenated, so the blocks of an
+# archive can be compressed in parallel.
+ARTIFACT_CODECS = {
+    "gzip": ("tgz", 9, range(0, 10),
+             lambda data, level: gzip.compress(data, level, mtime=0)),
+    "xz": ("tar.xz", 6, range(0, 10),
+           lambda data, level: lzma.compress(data, preset=level)),
+    "zstd": ("tar.zst", 3, range(1, 23),
+             lambda data, level:
+                 zstandard.ZstdCompressor(level=level).compress(data)),
+}
+
+
+class BlockCompressor():
+    """ Writable file object which splits the data written to it into blocks,
+        compresses each block independently using the given executor, and
+        writes the compressed blocks to the file in order """
+
+    BLOCK_SIZE = 4 * 1024 * 1024
+
+    # Maximum number of blocks held in memory while being compressed
+    MAX_PENDING_BLOCKS = 16
+
+    def __init__(self, path, compress, level, executor):
+        self.file = open(path, "wb")
+        self.compress = compress
+        self.level = level
+        self.executor = executor
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+
+    def _submit(self, block):
+        if len(self.pending) >= self.MAX_PENDING_BLOCKS:
+            self.file.write(self.pending.popleft().result())
+
+        self.pending.append(
+            self.executor.submit(self.compress, block, self.level))
+
+    def write(self, data):
+        self.buffer += data
+
+        while len(self.buffer) >= self.BLOCK_SIZE:
+            self._submit(bytes(self.buffer[:self.BLOCK_SIZE]))
+            del self.buffer[:self.BLOCK_SIZE]
+
+        return len(data)
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        try:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer.clear()
+
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Find the paths within basepath matching any of the glob patterns, in a single
+# walk of the directory tree which only descends into the directories that may
+# contain a match.
+# Patterns use the same syntax as pathlib.Path.glob, where '**' matches any
+# number of directories (not following symlinks).
+# For each matching path, yield the path, the path relative to basepath and
+# the list of indices of the patterns it matches.
+def find_matching_paths(basepath, patterns):
+    patterns = [pattern.split("/") for pattern in patterns]
+
+    # Return the states, as (pattern index, component index) pairs, which
+    # remain to be matched within a directory, following the '**' components
+    # which may match no directories at all
+    def expand(states):
+        expanded = set()
+        pending = list(states)
+        while pending:
+            state = pending.pop()
+            if state in expanded:
+                continue
+            expanded.add(state)
+            index, position = state
+            if patterns[index][position] == "**":
+                pending.append((index, position + 1))
+        return expanded
+
+    def walk(path, relative_path, states):
+        try:
+            entries = os.scandir(path)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            # As for pathlib.Path.glob, unreadable directories have no matches
+            return
+
+        with entries:
+            for entry in entries:
+                is_dir = entry.is_dir()
+                is_recursive_dir = is_dir and not entry.is_symlink()
+
+                matches = []
+                child_states = set()
+                for index, position in states:
+                    component = patterns[index][position]
+                    if component == "**":
+                        if is_recursive_dir:
+                            child_states.add((index, position))
+                    elif fnmatch.fnmatchcase(entry.name, component):
+                        if position + 1 == len(patterns[index]):
+                            matches.append(index)
+                        else:
+                            child_states.add((index, position + 1))
+
+                entry_relative_path = os.path.join(relative_path, entry.name)
+                if matches:
+                    yield entry.path, entry_relative_path, matches
+
+                if is_dir and child_states:
+                    yield from walk(entry.path, entry_relative_path,
+                                    expand(child_states))
+
+    yield from walk(os.path.abspath(basepath), "",
+                    expand((index, 0) for index in range(len(patterns))))
+
+
+# Return the list of (offset, length) extents of a file containing data, found
+# using SEEK_DATA and SEEK_HOLE, so excluding the holes of a sparse file. If
+# the system or file system does not support finding holes, the whole file is
+# returned as a single extent.
+def get_data_extents(path):
+    size = os.path.getsize(path)
+    if not hasattr(os, "SEEK_DATA"):
+        return [(0, size)] if size else []
+
+    extents = []
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        offset = 0
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # There is no more data before the end of the file
+                    break
+                raise
+            end = os.lseek(fd, start, os.SEEK_HOLE)
+            extents.append((start, end - start))
+            offset = end
+
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
+        # Holes are not supported
+        extents = [(0, size)] if size else []
+
+    finally:
+        os.close(fd)
+
+    return extents
+
+
+# Return a block map of a sparse file, in the format read by bmaptool (version
+# 2.0), so that the file can be written to a device by copying only the blocks
+# containing data.
+def create_bmap(path, size, extents, block_size=4096):
+
+    # Merge the extents into ranges of blocks
+    block_ranges = []
+    for offset, length in extents:
+        first = offset // block_size
+        last = (offset + length - 1) // block_size
+        if block_ranges and first <= block_ranges[-1][1] + 1:
+            block_ranges[-1][1] = max(block_ranges[-1][1], last)
+        else:
+            block_ranges.append([first, last])
+
+    ranges = []
+    mapped_blocks = 0
+    with open(path, "rb") as image:
+        for first, last in block_ranges:
+            checksum = hashlib.sha256()
+            image.seek(first * block_size)
+            remaining = min((last + 1) * block_size, size) - first * block_size
+            while remaining > 0:
+                data = image.read(min(remaining, 1024 * 1024))
+                if not data:
+                    break
+                checksum.update(data)
+                remaining -= len(data)
+
+            blocks = f"{first}-{last}" if last > first else f"{first}"
+            ranges.append(f'        <Range chksum="{checksum.hexdigest()}">'
+                          f' {blocks} </Range>\n')
+            mapped_blocks += last - first + 1
+
+    # The checksum of the block map is calculated with its value set to zeros
+    zero_checksum = "0" * hashlib.sha256().digest_size * 2
+    bmap = ('<?xml version="1.0" ?>\n'
+            '<bmap version="2.0">\n'
+            f'    <ImageSize> {size} </ImageSize>\n'
+            f'    <BlockSize> {block_size} </BlockSize>\n'
+            f'    <BlocksCount> {-(-size // block_size)} </BlocksCount>\n'
+            f'    <MappedBlocksCount> {mapped_blocks} </MappedBlocksCount>\n'
+            '    <ChecksumType> sha256 </ChecksumType>\n'
+            f'    <BmapFileChecksum> {zero_checksum} </BmapFileChecksum>\n'
+            '    <BlockMap>\n'
+            f'{"".join(ranges)}'
+            '    </BlockMap>\n'
+            '</bmap>\n')
+
+    bmap_checksum = hashlib.sha256(bmap.encode()).hexdigest()
+    return bmap.replace(zero_checksum, bmap_checksum, 1).encode()
+
+
+class SparseFileReader():
+    """ Readable file object returning the data of a tar member for a sparse
+        file in the PAX format 1.0 for GNU sparse files: the map of the data
+        extents, padded to a whole block, followed by the data of each
+        extent """
+
+    def __init__(self, path, size, extents):
+        # The map ends with an empty extent at the end of the file, so that
+        # trailing holes are kept when extracted
+        sparse_map = list(extents)
+        if not sparse_map or sum(sparse_map[-1]) < size:
+            sparse_map.append((size, 0))
+
+        numbers = [len(sparse_map)]
+        for offset, length in sparse_map:
+            numbers += [offset, length]
+        header = "".join(f"{number}\n" for number in numbers).encode()
+        header += tarfile.NUL * (-len(header) % tarfile.BLOCKSIZE)
+
+        self.header = io.BytesIO(header)
+        self.file = open(path, "rb")
+        self.extents = collections.deque(extents)
+        self.remaining = 0
+        self.size = len(header) + sum(length for _, length in extents)
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.size
+
+        # tarfile expects a short read only at the end of the data
+        data = self.header.read(size)
+        while len(data) < size:
+            while self.remaining == 0:
+                if not self.extents:
+                    return data
+                offset, self.remaining = self.extents.popleft()
+                self.file.seek(offset)
+
+            chunk = self.file.read(min(size - len(data), self.remaining))
+            if not chunk:
+                raise OSError(f"{self.file.name} was truncated while"
+                              " archived")
+            self.remaining -= len(chunk)
+            data += chunk
+
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Add a sparse file to the tar file, storing only its data extents
+def add_sparse_file(tar, tarinfo, path, extents):
+    size = tarinfo.size
+    with SparseFileReader(path, size, extents) as reader:
+        name = tarinfo.name
+        tarinfo.name = os.path.join(os.path.dirname(name), "GNUSparseFile.0",
+                                    os.path.basename(name))
+        tarinfo.size = reader.size
+        tarinfo.pax_headers = {
+            "GNU.sparse.major": "1",
+            "GNU.sparse.minor": "0",
+            "GNU.sparse.name": name,
+            "GNU.sparse.realsize": str(size),
+        }
+        tar.addfile(tarinfo, reader)
+
+
+# Glob patterns of the artifacts within the build directory, with the archive
+# each is added to, and the number of leading directories removed from its name
+# within the archive
+ARTIFACT_PATTERNS = [
+    # Config
+    ("conf", "conf", 0),
+
+    # Logs
+    ("logs", "bitbake-cookerdaemon.log", 0),
+    ("logs", "tmp*/log", 0),
+    ("logs", "tmp*/work/**/temp/log.*", 0),
+    ("logs", "tmp*/work/**/pseudo.log", 0),
+    ("logs", "tmp*/work/**/testimage", 0),
+
+    # Images, where the archive only contains the "images" subdirectories of
+    # each deploy directory
+    ("images", "tmp*/deploy/images", 2),
+]
+
+
+# Find the artifacts within the build directory in a single walk, yielding the
+# archive, path and name within the archive of each
+def find_artifacts(build_dir):
+    patterns = [pattern for _, pattern, _ in ARTIFACT_PATTERNS]
+
+    for path, relative_path, matches in find_matching_paths(build_dir,
+                                                            patterns):
+        added = set()
+        for index in matches:
+            archive, _, strip = ARTIFACT_PATTERNS[index]
+            if archive in added:
+                continue
+            added.add(archive)
+
+            arcname = os.path.join(*pathlib.Path(relative_path).parts[strip:])
+            yield archive, path, arcname
+
+
 # Deploy generated artifacts like build configs and logs.
-def deploy_artifacts(build_dir, build_artifacts_dir):
-    # For each file that matches one of the glob patterns,
-    # return the full path and the path relative to basepath
-    def find_files(basepath, patterns):
-        base_folder = pathlib.Path(basepath).absolute()
-        for pattern in patterns:
-            for filename in base_folder.glob(pattern):
-                relative_path = filename.relative_to(base_folder)
-                yield filename, str(relative_path)
-
-    # Build a tar file from the given iterator
-    def build_tar(outfile, files):
-        with tarfile.open(outfile, "w:gz") as tar:
-            for filename, arcname in files:
-                tar.add(filename, arcname)
-
-    # Collect config
-    tar_conf_filename = os.path.join(build_artifacts_dir, "conf.tgz")
+# The archives are built concurrently, compressed with the given codec of
+# ARTIFACT_CODECS, at the codec's default level if compression_level is None.
+def deploy_artifacts(build_dir, build_artifacts_dir, compression="gzip",
+                     compression_level=None):
+    extension, default_level, _, compress = ARTIFACT_CODECS[compression]
+    if compression_level is None:
+        compression_level = default_level
+
+    # Data extents of the sparse files among the images, by real path, so
+    # that the target of several symlinks is only examined once
+    sparse_images = {}
+
+    # Return the data extents of a path if it is, or links to, a sparse file,
+    # otherwise None
+    def get_sparse_extents(path):
+        path = os.path.realpath(path)
+        if path not in sparse_images:
+            extents = None
+            if os.path.isfile(path):
+                extents = get_data_extents(path)
+                if (sum(length for _, length in extents) ==
+                        os.path.getsize(path)):
+                    extents = None
+            sparse_images[path] = extents
+        return sparse_images[path]
+
+    # Add an images directory to the tar file. Only the data of sparse files
+    # is stored, alongside a block map for each unless the images already
+    # provide one. Symlinks are stored as links, with a link to the block map
+    # of their target if it is a sparse file.
+    def add_images(tar, path, arcname):
+        tarinfo = tar.gettarinfo(path, arcname)
+        if tarinfo is None:
+            # Unsupported file type, e.g. a socket
+            return
+
+        if tarinfo.isreg():
+            extents = get_sparse_extents(path)
+            if extents is None:
+                with open(path, "rb") as f:
+                    tar.addfile(tarinfo, f)
+                return
+
+            add_sparse_file(tar, tarinfo, path, extents)
+
+            if not os.path.exists(f"{path}.bmap"):
+                bmap = create_bmap(path, os.path.getsize(path), extents)
+                bmap_info = tarfile.TarInfo(f"{arcname}.bmap")
+                bmap_info.size = len(bmap)
+                bmap_info.mtime = tarinfo.mtime
+                bmap_info.uid, bmap_info.gid = tarinfo.uid, tarinfo.gid
+                bmap_info.uname = tarinfo.uname
+                bmap_info.gname = tarinfo.gname
+                tar.addfile(bmap_info, io.BytesIO(bmap))
+
+        elif tarinfo.issym():
+            tar.addfile(tarinfo)
+
+            if (not os.path.isabs(tarinfo.linkname) and
+                    not os.path.lexists(f"{path}.bmap") and
+                    get_sparse_extents(path) is not None):
+                bmap_info = copy.copy(tarinfo)
+                bmap_info.name = f"{arcname}.bmap"
+                bmap_info.linkname = f"{tarinfo.linkname}.bmap"
+                tar.addfile(bmap_info)
+
+        elif tarinfo.isdir():
+            tar.addfile(tarinfo)
+            for name in sorted(os.listdir(path)):
+                add_images(tar, os.path.join(path, name),
+                           os.path.join(arcname, name))
+
+        else:
+            tar.addfile(tarinfo)
+
+    # Build a compressed tar file from the files given by the queue, until
+    # None is received, adding each using the add function
+    def build_tar(outfile, files, add):
+        with BlockCompressor(outfile, compress, compression_level,
+                             compress_executor) as output:
+            with tarfile.open(fileobj=output, mode="w|") as tar:
+                for filename, arcname in iter(files.get, None):
+                    add(tar, filename, arcname)
+
+    # Pass each artifact to the queue of its archive as it is found
+    def queue_artifacts(archive_queues):
+        try:
+            for archive, path, arcname in find_artifacts(build_dir):
+                archive_queues[archive].put((path, arcname))
+        finally:
+            for archive_queue in archive_queues.values():
+                archive_queue.put(None)
+
+    archives = {
+        "conf": os.path.join(build_artifacts_dir, f"conf.{extension}"),
+        "logs": os.path.join(build_artifacts_dir, f"logs.{extension}"),
+        "images": os.path.join(build_artifacts_dir, f"images.{extension}"),
+    }
     print("Deploying build configuration artifacts into "
-          f"{tar_conf_filename}", file=sys.tee)
-    build_tar(tar_conf_filename, find_files(build_dir, ['conf']))
-
-    # Collect logs
-    tar_logs_filename = os.path.join(build_artifacts_dir, "logs.tgz")
-    log_patterns = [
-        'bitbake-cookerdaemon.log',
-        'tmp*/log',
-        'tmp*/work/**/temp/log.*',
-        'tmp*/work/**/pseudo.log',
-        'tmp*/work/**/testimage',
-    ]
-    print(f"Deploying build logs into {tar_logs_filename}", file=sys.tee)
-    build_tar(tar_logs_filename, find_files(build_dir, log_patterns))
+          f"{archives['conf']}", file=sys.tee)
+    print(f"Deploying build logs into {archives['logs']}", file=sys.tee)
+    print(f"Deploying images into {archives['images']}", file=sys.tee)
+
+    archive_queues = dict((archive, queue.Queue()) for archive in archives)
+
+    archive_add_functions = {
+        "conf": lambda tar, path, arcname: tar.add(path, arcname),
+        "logs": lambda tar, path, arcname: tar.add(path, arcname),
+        "images": add_images,
+    }
+
+    # Build the archives in separate threads, sharing the threads compressing
+    # their blocks, while the artifacts are found in another
+    with concurrent.futures.ThreadPoolExecutor(
+            os.cpu_count()) as compress_executor:
+        with concurrent.futures.ThreadPoolExecutor(
+                len(archives) + 1) as archive_executor:
+            futures = [archive_executor.submit(build_tar, outfile,
+                                               archive_queues[archive],
+                                               archive_add_functions[archive])
+                       for archive, outfile in archives.items()]
+            futures.append(archive_executor.submit(queue_artifacts,
+                                                   archive_queues))
+            for future in futures:
+                future.result()
+
+
+# Return the SHA-256 digest of the content of a file
+def hash_file(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            checksum.update(data)
+    return checksum.hexdigest()
+
+
+# ioctl request cloning a file, defined in linux/fs.h
+FICLONE = 0x40049409
+
+
+# Create dst as a reflink of src, sharing its data until either is modified.
+# Raises OSError if the file system does not support reflinks.
+def reflink_file(src, dst):
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+
+
+# Copy the content of a file, keeping the holes of a sparse file
+def copy_sparse_file(src, dst):
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        for offset, length in get_data_extents(src):
+            src_file.seek(offset)
+            dst_file.seek(offset)
+            while length > 0:
+                data = src_file.read(min(length, 1024 * 1024))
+                if not data:
+                    break
+                dst_file.write(data)
+                length -= len(data)
+
+        dst_file.truncate(os.path.getsize(src))
+
+
+class ArtifactStore():
+    """ Content-addressed store of build artifacts, shared between builds.
+        Each file is stored once within 'objects', named by the SHA-256 digest
+        of its content. Each deployment of a build's artifacts is a manifest
+        directory within 'manifests/<build name>', which contains the
+        artifacts as hardlinks or reflinks to the objects, and a
+        manifest.json describing them """
+
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, path, link="hardlink"):
+        self.path = pathlib.Path(path)
+        self.objects_dir = self.path / "objects"
+        self.manifests_dir = self.path / "manifests"
+        self.tmp_dir = self.path / "tmp"
+        self.link = link
+
+    def get_object_path(self, digest):
+        return self.objects_dir / digest[:2] / digest[2:]
+
+    def add_object(self, path):
+        """ Add the content of a file to the store, unless it is already
+            stored, and return its digest """
+
+        digest = hash_file(path)
+        object_path = self.get_object_path(digest)
+        if object_path.exists():
+            return digest
+
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write the object under a temporary name, so that concurrent
+        # deployments never link to an incomplete object
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        try:
+            try:
+                reflink_file(path, tmp_path)
+            except OSError:
+                copy_sparse_file(path, tmp_path)
+
+            # Objects are shared, so must not be modified through their links
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode) & 0o555)
+            os.replace(tmp_path, object_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
-    # Collect images
-    def find_image_files():
-        for deploydir, _ in find_files(build_dir, ['tmp*/deploy']):
-            # images.tgz only contains the "images" subdirectories
-            yield from find_files(deploydir, ['images'])
-    tar_image_filename = os.path.join(build_artifacts_dir, "images.tgz")
-    print(f"Deploying images into {tar_image_filename}", file=sys.tee)
-    build_tar(tar_image_filename, find_image_files())
+        return digest
+
+    def link_object(self, digest, path, mode):
+        """ Create path as a link to the object with the given digest """
+
+        object_path = self.get_object_path(digest)
+
+        if self.link == "reflink":
+            try:
+                reflink_file(object_path, path)
+                os.chmod(path, mode)
+                return
+            except OSError:
+                # Fall back to a hardlink
+                if os.path.exists(path):
+                    os.unlink(path)
+
+        try:
+            os.link(object_path, path)
+        except OSError as e:
+            if e.errno != errno.EMLINK:
+                raise
+            # The object has the maximum number of links, so use a copy
+            copy_sparse_file(object_path, path)
+            os.chmod(path, mode)
+
+    def deploy(self, build_name, artifacts, details):
+        """ Add the artifacts, given as (path, name within the manifest), to
+            the store as a new manifest of the build, described by the given
+            details, and return the path of the manifest. The content of the
+            files is hashed and stored in parallel. """
+
+        for directory in [self.objects_dir, self.manifests_dir, self.tmp_dir]:
+            directory.mkdir(parents=True, exist_ok=True)
+
+        # Sort the artifacts into regular files, symlinks and directories
+        files = {}
+        symlinks = {}
+        directories = set()
+
+        def add_artifact(path, name):
+            if os.path.islink(path):
+                symlinks[name] = os.readlink(path)
+            elif os.path.isfile(path):
+                files[name] = path
+            elif os.path.isdir(path):
+                directories.add(name)
+                for child in sorted(os.listdir(path)):
+                    add_artifact(os.path.join(path, child),
+                                 os.path.join(name, child))
+
+        for path, name in artifacts:
+            add_artifact(path, name)
+
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+            digests = dict(zip(files, executor.map(self.add_object,
+                                                   files.values())))
+
+        # Build the manifest under a temporary name, so that it is complete
+        # once it appears within the manifests
+        manifest_tmp_dir = pathlib.Path(tempfile.mkdtemp(dir=self.tmp_dir))
+        manifest = dict(details)
+        manifest["files"] = {}
+        manifest["symlinks"] = symlinks
+
+        for name in sorted(directories):
+            (manifest_tmp_dir / name).mkdir(parents=True, exist_ok=True)
+
+        for name, path in files.items():
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+            manifest_path = manifest_tmp_dir / name
+            manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            self.link_object(digests[name], manifest_path, mode)
+            manifest["files"][name] = {
+                "sha256": digests[name],
+                "size": os.path.getsize(path),
+                "mode": mode,
+            }
+
+        for name, target in symlinks.items():
+            manifest_path = manifest_tmp_dir / name
+            manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            os.symlink(target, manifest_path)
+
+        with open(manifest_tmp_dir / self.MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        manifest_dir = (self.manifests_dir / build_name /
+                        f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        manifest_dir.parent.mkdir(parents=True, exist_ok=True)
+        os.chmod(manifest_tmp_dir, 0o755)
+        os.rename(manifest_tmp_dir, manifest_dir)
+
+        print(f"Deployed {len(files)} files into the manifest {manifest_dir}",
+              file=sys.tee)
+        return manifest_dir
+
+    def collect_garbage(self, keep):
+        """ Remove all but the 'keep' most recent manifests of each build,
+            then the objects no longer referenced by any manifest. This should
+            not be run while artifacts are being deployed to the store. """
+
+        removed_manifests = 0
+        if self.manifests_dir.is_dir():
+            for build_dir in self.manifests_dir.iterdir():
+                # Manifest names start with their creation time
+                manifests = sorted(build_dir.iterdir())
+                for manifest_dir in manifests[:max(len(manifests) - keep, 0)]:
+                    shutil.rmtree(manifest_dir)
+                    removed_manifests += 1
+                if not any(build_dir.iterdir()):
+                    build_dir.rmdir()
+
+        referenced = set()
+        for manifest_file in self.manifests_dir.glob(
+                f"*/*/{self.MANIFEST_FILE}"):
+            with open(manifest_file) as f:
+                referenced.update(details["sha256"] for details in
+                                  json.load(f)["files"].values())
+
+        removed_objects = 0
+        removed_size = 0
+        for object_path in self.objects_dir.glob("*/*"):
+            if f"{object_path.parent.name}{object_path.name}" in referenced:
+                continue
+            removed_size += object_path.stat().st_blocks * 512
+            object_path.unlink()
+            removed_objects += 1
+
+        # Remove anything left behind by interrupted deployments
+        if self.tmp_dir.is_dir():
+            for tmp_path in self.tmp_dir.iterdir():
+                if tmp_path.is_dir() and not tmp_path.is_symlink():
+                    shutil.rmtree(tmp_path)
+                else:
+                    tmp_path.unlink()
+
+        print(f"Removed {removed_manifests} manifests and {removed_objects}"
+              f" objects ({removed_size // (1024 * 1024)} MiB) from the"
+              f" artifacts store {self.path}", file=sys.tee)
+        return 0
 
 
 # Convert string of paths with specified separator to a list of path objects
@@ -1093,6 +2330,485 @@ def print_config(config):
     print(config_str)
 
 
+# Return whether the kas command runs an interactive shell
+def is_interactive_shell(config):
+    return ("shell" in config.kas_arguments and
+            not any(x in config.kas_arguments for x in ["-c", "--command"]))
+
+
+# Open the config's log file, compressed and/or rotated if enabled, in the
+# given mode ("w" or "a")
+def open_log_file(config, log_file_mode="w"):
+    mk_newdir(os.path.dirname(os.path.realpath(config.log_file)))
+
+    if config.log_compression == "none" and not config.log_rotate_size:
+        return open(config.log_file, log_file_mode)
+
+    return RotatingLogFile(config.log_file, log_file_mode,
+                           config.log_compression,
+                           config.log_compression_level,
+                           config.log_rotate_size)
+
+
+# Direct stdout and the tee logger to the terminal and/or the config's log
+# file. When a prefix is given, each line written to either is prefixed with
+# it, so the output of concurrent builds can be told apart.
+def setup_logging(config, log_file_mode="w", prefix=None):
+
+    # Construct the loggers on the original stdout, rather than on the logger
+    # of a previous config
+    sys.stdout = sys.__stdout__
+    if prefix is not None:
+        sys.stdout = PrefixWriter(sys.stdout, prefix)
+
+    # By default, write both stdout and tee to only terminal
+    # These objects must be constructed in this order (as TeeLogger reads
+    # from sys.stdout)
+    sys.tee = TeeLogger(LogOpt.TO_TERM)
+    sys.stdout = TeeLogger(LogOpt.TO_TERM)
+
+    if config.log_file:
+        log_file = open_log_file(config, log_file_mode)
+        if prefix is not None:
+            log_file = PrefixWriter(log_file, prefix)
+
+        # By default, if we have a log file then only write to it
+        # But provide a logger to write to both terminal
+        # and the log file for important messages
+        sys.stdout.log_opt = LogOpt.TO_FILE
+        sys.tee.log_opt = LogOpt.TO_BOTH
+        sys.stdout.log_file = log_file
+        sys.tee.log_file = log_file
+
+        if is_interactive_shell(config):
+            # Although log_file has been given, there is no point running
+            # an interactive kas shell with its input/output being hidden
+            # from the terminal, so override the behavior to log to both
+            sys.stdout.log_opt = LogOpt.TO_BOTH
+
+
+# Run the build of a config, and deploy its artifacts if enabled.
+# * concurrent_builds: number of builds running at the same time, which share
+#   the number_threads budget between them.
+# * interactive: whether the kas command is attached to the terminal.
+def run_build(config, concurrent_builds=1, interactive=True):
+    exit_code = 0
+
+    print(f"Starting build task: {paths_to_string(config.kasfile)}",
+          file=sys.tee)
+
+    # Create directories if they don't exist
+    mk_newdir(config.out_dir)
+    mk_newdir(config.build_dir)
+
+    if config.session:
+        run_system = SessionContainerEngine(
+            config.project_root,
+            config.kas_arguments,
+            config.container_image,
+            config.container_image_version,
+            config.session)
+    elif config.containerize:
+        run_system = ContainerEngine(config.project_root,
+                                     config.kas_arguments,
+                                     config.container_image,
+                                     config.container_image_version)
+
+    if config.containerize:
+        kas_file_common_dir = get_kas_file_common_dir(config.kasfile,
+                                                      config.project_root)
+        # Translate kas files to container
+        config_volume_key = "common_configs"
+        kas_paths_inside = get_kas_container_paths(
+            config.kasfile, kas_file_common_dir,
+            pathlib.Path("/", config_volume_key))
+        run_system.add_path(config_volume_key, kas_file_common_dir,
+                            access="ro")
+        run_system.set_kas_files(kas_paths_inside)
+
+        # Pass user and group ID to container engine env
+        run_system.add_env("USER_ID", os.getuid())
+        run_system.add_env("GROUP_ID", os.getgid())
+
+        # Set network mode
+        run_system.add_arg(f"--network={config.network_mode}")
+
+        if config.engine_arguments:
+            run_system.add_arg(config.engine_arguments)
+
+    else:  # Non-containerized run
+        run_system = RunSystem(config.project_root, config.kas_arguments)
+        run_system.set_kas_files(config.kasfile)
+
+    run_system.interactive = interactive
+
+    if config.status_file or config.metrics_file:
+        run_system.progress = BuildProgress(config.build_dir_name,
+                                            config.status_file,
+                                            config.metrics_file)
+
+    # Mount and set up workdir
+    run_system.add_path("work/kas_work_dir",
+                        config.project_root,
+                        env_var="KAS_WORK_DIR")
+
+    if config.containerize:
+        run_system.add_arg(f"--workdir=/work/kas_work_dir")
+
+    # Mount and set up build directory
+    run_system.add_path("work/kas_build_dir",
+                        config.build_dir,
+                        env_var="KAS_BUILD_DIR")
+
+    # Configure local caches
+    mk_newdir(config.sstate_dir)
+    run_system.add_path("sstate_dir", config.sstate_dir,
+                        env_var="SSTATE_DIR")
+
+    mk_newdir(config.dl_dir)
+    run_system.add_path("dl_dir", config.dl_dir, env_var="DL_DIR")
+
+    # Configure cache mirrors
+    if config.sstate_mirror:
+        if config.sstate_mirror.startswith("http"):
+            # Formatted now so not set by run_system.add_env
+            SSTATE_MIRRORS = (f"file://.* {config.sstate_mirror}/PATH;"
+                              "downloadfilename=PATH")
+        else:
+            mk_newdir(config.sstate_mirror)
+            run_system.add_path("sstate_mirrors", config.sstate_mirror,
+                                access="ro")
+            # Not formatted now so set by run_system.add_env
+            SSTATE_MIRRORS = ("file://.* file://{sstate_mirrors}/PATH;"
+                              "downloadfilename=PATH")
+
+        run_system.add_env("SSTATE_MIRRORS", SSTATE_MIRRORS)
+
+    if config.downloads_mirror:
+        if config.downloads_mirror.startswith("http"):
+            SOURCE_MIRROR_URL = config.downloads_mirror
+        else:
+            mk_newdir(config.downloads_mirror)
+            run_system.add_path("source_mirror_url",
+                                config.downloads_mirror, access="ro")
+            SOURCE_MIRROR_URL = "file://{source_mirror_url}"
+
+        run_system.add_env("SOURCE_MIRROR_URL", SOURCE_MIRROR_URL)
+        run_system.add_env('INHERIT', "own-mirrors")
+        run_system.add_env('BB_GENERATE_MIRROR_TARBALLS', "1")
+
+    if config.number_threads:
+        # Concurrent builds each get an equal share of the threads, both for
+        # bitbake tasks and for the make jobs within each task. kas only
+        # forwards these to bitbake as they are listed in the env section of
+        # the kas configs
+        number_threads = max(1, int(config.number_threads) //
+                             concurrent_builds)
+        run_system.add_env('BB_NUMBER_THREADS', number_threads)
+        if concurrent_builds > 1:
+            run_system.add_env('PARALLEL_MAKE', f"-j {number_threads}")
+
+    exit_code |= run_system.run()
+
+    # Grab build artifacts and store in artifacts_store or in
+    # artifacts_dir/buildname
+    if config.deploy_artifacts and config.artifacts_store:
+        store = ArtifactStore(config.artifacts_store,
+                              config.artifacts_store_link)
+        details = {
+            "build": config.build_dir_name,
+            "kasfile": [str(kpath) for kpath in config.kasfile],
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+
+        run_external_effect(
+            lambda:
+                store.deploy(config.build_dir_name,
+                             ((path, arcname) for _, path, arcname
+                              in find_artifacts(config.build_dir)),
+                             details),
+            f"Deploying artifacts for {paths_to_string(config.kasfile)} into"
+            f" the store {config.artifacts_store}",
+            dict(file=sys.tee))
+
+    elif config.deploy_artifacts:
+        mk_newdir(config.artifacts_dir)
+
+        build_artifacts_dir = os.path.join(config.artifacts_dir,
+                                           config.build_dir_name)
+        mk_newdir(build_artifacts_dir)
+
+        run_external_effect(
+            lambda:
+                deploy_artifacts(config.build_dir, build_artifacts_dir,
+                                 config.artifacts_compression,
+                                 config.artifacts_compression_level),
+            f"Deploying artifacts for {paths_to_string(config.kasfile)}",
+            dict(file=sys.tee))
+
+    print(f"Finished build task: {paths_to_string(config.kasfile)}\n",
+          file=sys.tee)
+
+    return exit_code
+
+
+# Run the build of a config within a process started by run_parallel_builds.
+# Its output is prefixed with the build directory name, and appended to the
+# log file shared by the builds.
+def run_build_process(config, concurrent_builds):
+    setup_logging(config, log_file_mode="a",
+                  prefix=f"[{config.build_dir_name}] ")
+
+    exit_code = run_build(config, concurrent_builds, interactive=False)
+
+    sys.stdout.flush()
+    sys.tee.flush()
+    if sys.tee.log_file:
+        sys.tee.log_file.close()
+    exit(exit_code)
+
+
+# Check that the configs can be built at the same time
+def validate_parallel_builds(configs):
+    valid = True
+
+    build_dirs = [config.build_dir for config in configs]
+    for build_dir in set(build_dirs):
+        if build_dirs.count(build_dir) > 1:
+            print(f"ERROR: Several configs use the build directory"
+                  f" {build_dir}, so cannot be built in parallel")
+            valid = False
+
+    # Concurrent writes to a compressed or rotated log file would corrupt it
+    log_files = [config.log_file for config in configs
+                 if config.log_file and (config.log_compression != "none" or
+                                         config.log_rotate_size)]
+    for log_file in set(log_files):
+        if log_files.count(log_file) > 1:
+            print(f"ERROR: Several configs write the compressed or rotated"
+                  f" log file {log_file}, so cannot be built in parallel")
+            valid = False
+
+    for setting in ["status_file", "metrics_file"]:
+        paths = [getattr(config, setting) for config in configs
+                 if getattr(config, setting)]
+        for path in set(paths):
+            if paths.count(path) > 1:
+                print(f"ERROR: Several configs write the {setting} {path},"
+                      " so cannot be built in parallel")
+                valid = False
+
+    for config in configs:
+        if is_interactive_shell(config):
+            print(f"ERROR: {get_config_label(config)} runs an"
+                  " interactive kas shell, so cannot be built in parallel")
+            valid = False
+        if config.session:
+            print(f"ERROR: {get_config_label(config)} runs in the"
+                  f" session {config.session}, so cannot be built in"
+                  " parallel")
+            valid = False
+
+    return valid
+
+
+# Return whether the kas files of the config 'base' are a proper prefix of
+# those of 'config', using the same sstate cache, so that 'config' can reuse
+# the sstate produced by building 'base'
+def is_base_config(base, config):
+    return (len(base.kasfile) < len(config.kasfile) and
+            config.kasfile[:len(base.kasfile)] == base.kasfile and
+            base.sstate_dir == config.sstate_dir)
+
+
+# Return, for each config, the indices of the configs to build before it
+def get_build_dependencies(configs):
+    return [[index for index, base in enumerate(configs)
+             if is_base_config(base, config)]
+            for config in configs]
+
+
+# Order the configs so that each is built after its base configs, otherwise
+# keeping the order in which they were given
+def order_builds(configs):
+    dependencies = get_build_dependencies(configs)
+    ordered = []
+
+    while len(ordered) < len(configs):
+        ready = next(index for index in range(len(configs))
+                     if index not in ordered and
+                     all(base in ordered for base in dependencies[index]))
+        ordered.append(ready)
+
+    return [configs[index] for index in ordered]
+
+
+# Return a copy of config which builds only its first kas files, given by
+# prefix, into its own build directory, to fill the sstate cache for the
+# configs which share those kas files
+def create_base_config(config, prefix):
+    base = copy.copy(config)
+    base.kasfile = list(prefix)
+    base.build_dir_name = "_".join(kpath.stem for kpath in prefix)
+    base.build_dir = config.out_dir / base.build_dir_name
+    base.name = f"{base.build_dir_name} (base)"
+    base.kas_arguments = "build"
+    base.deploy_artifacts = False
+    base.session = None
+
+    # The progress of the base build is not reported as that of the config
+    base.status_file = None
+    base.metrics_file = None
+
+    # Compressed or rotated log files cannot be shared by parallel builds
+    if config.log_file and (config.log_compression != "none" or
+                            config.log_rotate_size):
+        base.log_file = f"{config.log_file}.{base.build_dir_name}"
+
+    return base
+
+
+# Add a base config for each longest prefix of kas files shared by two of the
+# configs, unless a config already builds those kas files. The base configs are
+# placed before the first config using them.
+def add_base_configs(configs):
+    prefixes = []
+
+    for index, config in enumerate(configs):
+        for other in configs[index + 1:]:
+            if config.sstate_dir != other.sstate_dir:
+                continue
+
+            length = 0
+            while (length < min(len(config.kasfile), len(other.kasfile)) and
+                   config.kasfile[length] == other.kasfile[length]):
+                length += 1
+
+            prefix = (tuple(config.kasfile[:length]), config.sstate_dir)
+            if length > 0 and prefix not in prefixes:
+                prefixes.append(prefix)
+
+    existing = [(tuple(config.kasfile), config.sstate_dir)
+                for config in configs]
+
+    for prefix in prefixes:
+        if prefix in existing:
+            continue
+
+        base = None
+        for index, config in enumerate(configs):
+            if (tuple(config.kasfile[:len(prefix[0])]) == prefix[0] and
+                    config.sstate_dir == prefix[1]):
+                base = create_base_config(config, prefix[0])
+                configs.insert(index, base)
+                break
+
+        print(f"Adding base build of the shared kas files:"
+              f" {paths_to_string(base.kasfile)}", file=sys.tee)
+
+    return configs
+
+
+# Build the configs with up to 'parallel' builds running at the same time,
+# each within its own process, as the run system sets up the environment of
+# the whole process. The builds share the sstate and downloads caches, which
+# bitbake supports using concurrently. A config is only started once its base
+# configs have been built, so that it reuses their sstate rather than racing
+# them to produce it.
+# Returns a list of (config, exit code, duration) for each build.
+def run_parallel_builds(configs, parallel):
+    results = []
+
+    print(f"Building {len(configs)} configs with up to"
+          f" {min(parallel, len(configs))} builds running in parallel",
+          file=sys.tee)
+
+    # Create the shared directories once, before the builds race to do so
+    for config in configs:
+        mk_newdir(config.out_dir)
+        mk_newdir(config.sstate_dir)
+        mk_newdir(config.dl_dir)
+
+    dependencies = get_build_dependencies(configs)
+
+    context = multiprocessing.get_context("fork")
+    pending = list(range(len(configs)))
+    finished = set()
+    running = {}
+
+    try:
+        while pending or running:
+            ready = [index for index in pending
+                     if all(base in finished for base in dependencies[index])]
+
+            # Share the threads between the builds which can run now
+            concurrent_builds = min(parallel, len(running) + len(ready))
+
+            for index in ready[:parallel - len(running)]:
+                pending.remove(index)
+                config = configs[index]
+
+                # Flush the output first, so it is not also written by the
+                # forked process
+                sys.stdout.flush()
+                sys.tee.flush()
+
+                process = context.Process(target=run_build_process,
+                                          args=(config, concurrent_builds))
+                process.start()
+                running[process.sentinel] = (process, index,
+                                             time.monotonic())
+
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                process, index, start_time = running.pop(sentinel)
+                process.join()
+                finished.add(index)
+
+                config = configs[index]
+                exit_code = 0 if process.exitcode == 0 else 1
+                results.append((config, exit_code,
+                                time.monotonic() - start_time))
+                if exit_code != 0:
+                    print(f"Build task failed: {get_config_label(config)}",
+                          file=sys.tee)
+
+    except KeyboardInterrupt:
+        # The builds received the interrupt too, so wait for them to stop
+        # their containers
+        for process, _, _ in running.values():
+            process.join()
+        raise
+
+    return results
+
+
+# Return the name of a config, or its kas files if it is not named
+def get_config_label(config):
+    return config.name or paths_to_string(config.kasfile)
+
+
+# Print the result and duration of each build, in the order of the configs
+def print_build_summary(configs, results):
+    results = dict((id(config), (exit_code, duration))
+                   for config, exit_code, duration in results)
+
+    summary = {}
+    failed = 0
+    for config in configs:
+        exit_code, duration = results[id(config)]
+        minutes, seconds = divmod(int(duration), 60)
+        hours, minutes = divmod(minutes, 60)
+        status = "PASS" if exit_code == 0 else "FAIL"
+        summary[get_config_label(config)] = (
+            f"{status} ({hours}:{minutes:02}:{seconds:02})")
+        if exit_code != 0:
+            failed += 1
+
+    summary_description = format_dict(summary, "\t{key}{padding}: {value}\n")
+    print(f"Build summary ({failed} of {len(configs)} builds failed):\n"
+          f"{summary_description}", file=sys.tee)
+
+
 # Entry Point
 def main():
     exit_code = 0
@@ -1111,6 +2827,10 @@ def main():
     print_environment()
     print_args(args)
 
+    if args["parallel"] < 1:
+        print("ERROR: The number of parallel builds must be at least 1")
+        exit(1)
+
     default_config = RunnerSettings(settings_details)
     configs, config_names = get_configs(default_config, args)
 
@@ -1128,35 +2848,24 @@ def main():
         print("ERROR: No config was provided")
         exit(1)
 
-    for config in configs:
-
-        print_config(config)
+    # Several builds append to their log files, so truncate each only once
+    log_file_mode = "w"
+    if len(configs) > 1:
+        log_file_mode = "a"
+        log_configs = {config.log_file: config for config in configs
+                       if config.log_file}
+        for config in log_configs.values():
+            open_log_file(config, "w").close()
 
-        # By default, write both stdout and tee to only terminal
-        # These objects must be constructed in this order (as TeeLogger reads
-        # from sys.stdout)
-        sys.tee = TeeLogger(LogOpt.TO_TERM)
-        sys.stdout = TeeLogger(LogOpt.TO_TERM)
+    build_configs = []
+    results = []
 
-        if config.log_file:
-            mk_newdir(os.path.dirname(os.path.realpath(config.log_file)))
-            log_file = open(config.log_file, "w")
+    for config in configs:
 
-            # By default, if we have a log file then only write to it
-            # But provide a logger to write to both terminal
-            # and the log file for important messages
-            sys.stdout.log_opt = LogOpt.TO_FILE
-            sys.tee.log_opt = LogOpt.TO_BOTH
-            sys.stdout.log_file = log_file
-            sys.tee.log_file = log_file
+        print_config(config)
 
-            if ("shell" in config.kas_arguments and
-                    not any(x in config.kas_arguments
-                            for x in ["-c", "--command"])):
-                # Although log_file has been given, there is no point running
-                # an interactive kas shell with its input/output being hidden
-                # from the terminal, so override the behavior to log to both
-                sys.stdout.log_opt = LogOpt.TO_BOTH
+        setup_logging(config, log_file_mode)
+        log_config = config
 
         # Print the argument
         if args["print"]:
@@ -1172,115 +2881,74 @@ def main():
                 exit(1)
             continue
 
-        print(f"Starting build task: {paths_to_string(config.kasfile)}",
-              file=sys.tee)
-
-        # Create directories if they don't exist
-        mk_newdir(config.out_dir)
-        mk_newdir(config.build_dir)
-
-        if config.containerize:
-            run_system = ContainerEngine(config.project_root,
-                                         config.kas_arguments,
-                                         config.container_image,
-                                         config.container_image_version)
-
-            kas_file_common_dir = get_kas_file_common_dir(config.kasfile,
-                                                          config.project_root)
-            # Translate kas files to container
-            config_volume_key = "common_configs"
-            kas_paths_inside = get_kas_container_paths(
-                config.kasfile, kas_file_common_dir,
-                pathlib.Path("/", config_volume_key))
-            run_system.add_path(config_volume_key, kas_file_common_dir,
-                                access="ro")
-            run_system.set_kas_files(kas_paths_inside)
-
-            # Pass user and group ID to container engine env
-            run_system.add_env("USER_ID", os.getuid())
-            run_system.add_env("GROUP_ID", os.getgid())
-
-            # Set network mode
-            run_system.add_arg(f"--network={config.network_mode}")
-
-            if config.engine_arguments:
-                run_system.add_arg(config.engine_arguments)
+        if config.artifacts_store_gc:
+            store = ArtifactStore(config.artifacts_store)
+            exit_code |= run_external_effect(
+                lambda: store.collect_garbage(config.artifacts_store_keep),
+                f"Collecting garbage of the artifacts store:"
+                f" {config.artifacts_store}",
+                dict(file=sys.tee)) or 0
+            continue
 
-        else:  # Non-containerized run
-            run_system = RunSystem(config.project_root, config.kas_arguments)
-            run_system.set_kas_files(config.kasfile)
+        if config.session_stop:
+            exit_code |= run_external_effect(
+                lambda: SessionContainerEngine.stop(config.session),
+                f"Stopping session: {config.session}",
+                dict(file=sys.tee)) or 0
+            continue
 
-        # Mount and set up workdir
-        run_system.add_path("work/kas_work_dir",
-                            config.project_root,
-                            env_var="KAS_WORK_DIR")
+        build_configs.append(config)
 
-        if config.containerize:
-            run_system.add_arg(f"--workdir=/work/kas_work_dir")
+    if args["build_base"]:
+        build_configs = add_base_configs(build_configs)
 
-        # Mount and set up build directory
-        run_system.add_path("work/kas_build_dir",
-                            config.build_dir,
-                            env_var="KAS_BUILD_DIR")
+        # The builds append to the log files, so also truncate those given
+        # to the base configs alone
+        log_files = set(config.log_file for config in configs)
+        base_log_configs = {config.log_file: config
+                            for config in build_configs
+                            if config.log_file and
+                            config.log_file not in log_files}
+        for config in base_log_configs.values():
+            open_log_file(config, "w").close()
 
-        # Configure local caches
-        mk_newdir(config.sstate_dir)
-        run_system.add_path("sstate_dir", config.sstate_dir,
-                            env_var="SSTATE_DIR")
+    # Build the configs sharing a base of kas files after the base
+    build_configs = order_builds(build_configs)
 
-        mk_newdir(config.dl_dir)
-        run_system.add_path("dl_dir", config.dl_dir, env_var="DL_DIR")
-
-        # Configure cache mirrors
-        if config.sstate_mirror:
-            if config.sstate_mirror.startswith("http"):
-                # Formatted now so not set by run_system.add_env
-                SSTATE_MIRRORS = (f"file://.* {config.sstate_mirror}/PATH;"
-                                  "downloadfilename=PATH")
-            else:
-                mk_newdir(config.sstate_mirror)
-                run_system.add_path("sstate_mirrors", config.sstate_mirror,
-                                    access="ro")
-                # Not formatted now so set by run_system.add_env
-                SSTATE_MIRRORS = ("file://.* file://{sstate_mirrors}/PATH;"
-                                  "downloadfilename=PATH")
-
-            run_system.add_env("SSTATE_MIRRORS", SSTATE_MIRRORS)
-
-        if config.downloads_mirror:
-            if config.downloads_mirror.startswith("http"):
-                SOURCE_MIRROR_URL = config.downloads_mirror
-            else:
-                mk_newdir(config.downloads_mirror)
-                run_system.add_path("source_mirror_url",
-                                    config.downloads_mirror, access="ro")
-                SOURCE_MIRROR_URL = "file://{source_mirror_url}"
+    if args["parallel"] > 1 and build_configs:
+        if not validate_parallel_builds(build_configs):
+            print("ERROR: Invalid configuration")
+            exit(1)
 
-            run_system.add_env("SOURCE_MIRROR_URL", SOURCE_MIRROR_URL)
-            run_system.add_env('INHERIT', "own-mirrors")
-            run_system.add_env('BB_GENERATE_MIRROR_TARBALLS', "1")
+        # The compressed streams of several processes cannot be interleaved
+        # in a log file, so only the builds write to compressed or rotated
+        # log files while they are running. The log file of log_config is
+        # then reopened for the build summary.
+        log_file = sys.tee.log_file
+        if isinstance(log_file, RotatingLogFile):
+            terminal_config = copy.copy(log_config)
+            terminal_config.log_file = None
+            setup_logging(terminal_config)
 
-        if config.number_threads:
-            run_system.add_env('BB_NUMBER_THREADS', config.number_threads)
+        results = run_parallel_builds(build_configs, args["parallel"])
 
-        exit_code |= run_system.run()
+        if isinstance(log_file, RotatingLogFile):
+            setup_logging(log_config, "a")
 
-        # Grab build artifacts and store in artifacts_dir/buildname
-        if config.deploy_artifacts:
-            mk_newdir(config.artifacts_dir)
+    elif build_configs:
+        for config in build_configs:
+            setup_logging(config, log_file_mode)
 
-            build_artifacts_dir = os.path.join(config.artifacts_dir,
-                                               config.build_dir_name)
-            mk_newdir(build_artifacts_dir)
+            start_time = time.monotonic()
+            build_exit_code = run_build(config)
+            results.append((config, build_exit_code,
+                            time.monotonic() - start_time))
 
-            run_external_effect(
-                lambda:
-                    deploy_artifacts(config.build_dir, build_artifacts_dir),
-                f"Deploying artifacts for {paths_to_string(config.kasfile)}",
-                dict(file=sys.tee))
+    for _, build_exit_code, _ in results:
+        exit_code |= build_exit_code
 
-        print(f"Finished build task: {paths_to_string(config.kasfile)}\n",
-              file=sys.tee)
+    if len(build_configs) > 1:
+        print_build_summary(build_configs, results)
 
     if is_dry_run:
         print("Finished dry run", file=sys.tee)
@@ -1323,5 +2991,526 @@ class TeeLogger(object):
             self.log_file.close()
 
 
+class PrefixWriter(object):
+    """ Stream wrapper that prefixes each line written to the stream, and
+        writes whole lines only, so that the lines written by several
+        processes to the same stream are not interleaved """
+
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+        self.partial_line = ""
+
+    def write(self, msg):
+        lines = (self.partial_line + msg).split("\n")
+        self.partial_line = lines.pop()
+
+        if lines:
+            self.stream.write("".join(f"{self.prefix}{line}\n"
+                                      for line in lines))
+            self.stream.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        if self.partial_line:
+            self.stream.write(f"{self.prefix}{self.partial_line}")
+            self.partial_line = ""
+        self.stream.close()
+
+    def __getattr__(self, name):
+        # Delegate other attributes, such as name and closed, to the stream
+        return getattr(self.stream, name)
+
+
+class LogFileWriter(threading.Thread):
+    """ Thread writing text to a log file in batches, so that the output of
+        the kas command is not held up by the file writes. The file is flushed
+        at most once per FLUSH_INTERVAL seconds while text is being written,
+        and once no more text has been written for FLUSH_INTERVAL seconds """
+
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, log_file):
+        super().__init__(daemon=True)
+        self.log_file = log_file
+        self.queue = queue.SimpleQueue()
+
+    def write(self, text):
+        if text:
+            self.queue.put(text)
+
+    def close(self):
+        """ Write and flush the remaining text, then stop the thread """
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        last_flush = time.monotonic()
+
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.FLUSH_INTERVAL)]
+            except queue.Empty:
+                self.log_file.flush()
+                last_flush = time.monotonic()
+                continue
+
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            closed = batch[-1] is None
+            if closed:
+                batch.pop()
+            self.log_file.write("".join(batch))
+
+            if closed or time.monotonic() - last_flush >= self.FLUSH_INTERVAL:
+                self.log_file.flush()
+                last_flush = time.monotonic()
+
+            if closed:
+                return
+
+
+# Compression codecs for the log file, with the extension of the log file, the
+# default compression level, the range of valid levels, a function returning a
+# compressor object for the level and the mode in which to flush the
+# compressor without ending its member (or frame) of the stream. Flushing a
+# compressor in the default mode ends its member, and members can be
+# concatenated.
+LOG_CODECS = {
+    "gzip": (".gz", 6, range(0, 10),
+             lambda level: zlib.compressobj(level, zlib.DEFLATED, 31),
+             zlib.Z_SYNC_FLUSH),
+    "zstd": (".zst", 3, range(1, 23),
+             lambda level: zstandard.ZstdCompressor(level=level).compressobj(),
+             zstandard.COMPRESSOBJ_FLUSH_BLOCK if zstandard else None),
+}
+
+
+class RotatingLogFile(object):
+    """ Text log file which is compressed as it is written and/or continued in
+        a new numbered file once it reaches ROTATE_SIZE bytes on disk.
+
+        The compressed stream is restarted at a checkpoint at least every
+        CHECKPOINT_SIZE bytes of text, and the lines of the log matching
+        SECTION_PATTERN are recorded in the JSON Lines index file
+        '{path}.index', with the name of the log file containing the line,
+        the offset in that file of the checkpoint before the line and the
+        number of bytes of text from the checkpoint to the line. A section of
+        the log can then be read by decompressing from that offset only """
+
+    CHECKPOINT_SIZE = 1024 * 1024
+
+    # Minimum interval in seconds between flushes of the compressed stream,
+    # as each flush reduces the compression ratio
+    FLUSH_INTERVAL = 1.0
+
+    # Lines which are indexed, following the line prefix of a parallel build:
+    # kas-runner messages, bitbake and kas errors, and bitbake task summaries.
+    # The newline ending the previous line is matched first, as searching for
+    # it is much faster than matching at the start of each line.
+    SECTION_PATTERN = re.compile(
+        r"\n((?:\[[^\]\n]*\] )?(?:Starting build task|Running kas command"
+        r"|Deploying |ERROR:|(?:NOTE: Tasks )?Summary:"
+        r"|\d{4}-\d\d-\d\d [\d:]+ - ERROR )[^\n]*)")
+
+    # Maximum length of the indexed lines, as longer lines are not indexed
+    MAX_LINE_LENGTH = 4096
+
+    def __init__(self, path, mode="w", compression="none", level=None,
+                 rotate_size=0):
+        self.path = path
+        self.extension = ""
+        self.codec = None
+        self.level = level
+        self.rotate_size = rotate_size * 1024 * 1024
+
+        if compression != "none":
+            self.extension, default_level, _, new_compressor, \
+                self.flush_mode = LOG_CODECS[compression]
+            self.codec = new_compressor
+            if level is None:
+                self.level = default_level
+
+        if mode == "w":
+            for log_path, _ in self.find_log_files():
+                os.remove(log_path)
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+
+        # Continue the last rotated log file, if any
+        self.number = None
+        if self.rotate_size:
+            self.number = max((number for _, number in self.find_log_files()
+                               if number is not None), default=0)
+
+        self.file = open(self.name, "ab")
+        self.index = open(self.index_path, "a")
+
+        self.compressor = None
+        self.unflushed = False
+        self.last_flush = time.monotonic()
+        self.checkpoint_offset = self.file.tell()
+        self.checkpoint_size = 0
+        self.partial_line = "\n"
+        self.lock = threading.Lock()
+
+        # The log file is only written by the process which opened it, as a
+        # forked process closing its copy must not end the compressed stream
+        self.pid = os.getpid()
+        atexit.register(self.close)
+
+    @property
+    def name(self):
+        if self.number is None:
+            return f"{self.path}{self.extension}"
+        return f"{self.path}.{self.number:03d}{self.extension}"
+
+    @property
+    def index_path(self):
+        return f"{self.path}.index"
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    # Yield the existing log files, and their number if they were rotated
+    def find_log_files(self):
+        directory = os.path.dirname(self.path) or "."
+        base_name = os.path.basename(self.path)
+        pattern = re.compile(rf"{re.escape(base_name)}(?:\.(\d+))?"
+                             rf"{re.escape(self.extension)}")
+
+        for entry in os.scandir(directory):
+            match = pattern.fullmatch(entry.name)
+            if match:
+                number = match.group(1)
+                yield (entry.path, int(number) if number else None)
+
+    def _end_checkpoint(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
+            self.compressor = None
+            self.unflushed = False
+
+        self.checkpoint_offset = self.file.tell()
+        self.checkpoint_size = 0
+
+    def _index_sections(self, text, text_offset):
+        """ Index the complete lines matching SECTION_PATTERN, where the
+            text (following the partial line) starts at text_offset bytes
+            from the checkpoint """
+
+        # The partial line starts with the newline ending the previous line
+        lines = self.partial_line + text
+        end = lines.rfind("\n")
+
+        offset = text_offset - len(self.partial_line.encode())
+        position = 0
+        for match in self.SECTION_PATTERN.finditer(lines, 0, max(end, 0)):
+            line = match.group(1)
+            if len(line) > self.MAX_LINE_LENGTH:
+                continue
+
+            offset += len(lines[position:match.start(1)].encode())
+            position = match.start(1)
+
+            self.index.write(json.dumps({
+                "file": os.path.basename(self.name),
+                "offset": self.checkpoint_offset,
+                "skip": offset,
+                "line": line,
+            }) + "\n")
+
+        # Longer lines are not indexed, so are not kept in full
+        if end >= 0:
+            self.partial_line = lines[end:]
+        else:
+            self.partial_line = lines
+        if len(self.partial_line) > self.MAX_LINE_LENGTH:
+            self.partial_line = ""
+
+    def _write(self, text):
+        data = text.encode()
+
+        if self.compressor is None and self.codec is not None:
+            self.compressor = self.codec(self.level)
+
+        self._index_sections(text, self.checkpoint_size)
+
+        if self.compressor is not None:
+            self.file.write(self.compressor.compress(data))
+            self.unflushed = True
+        else:
+            self.file.write(data)
+        self.checkpoint_size += len(data)
+
+    def write(self, msg):
+        # Start checkpoints and log files on a new line
+        end = msg.rfind("\n") + 1
+
+        with self.lock:
+            if end:
+                self._write(msg[:end])
+
+                if (self.rotate_size and
+                        self.file.tell() >= self.rotate_size):
+                    self._end_checkpoint()
+                    self.file.close()
+                    self.number += 1
+                    self.file = open(self.name, "ab")
+                    self.checkpoint_offset = 0
+
+                elif self.checkpoint_size >= self.CHECKPOINT_SIZE:
+                    self._end_checkpoint()
+
+            if end < len(msg):
+                self._write(msg[end:])
+
+    def flush(self):
+        with self.lock:
+            if self.file.closed:
+                return
+
+            if (self.unflushed and time.monotonic() - self.last_flush >=
+                    self.FLUSH_INTERVAL):
+                self.file.write(self.compressor.flush(self.flush_mode))
+                self.unflushed = False
+                self.last_flush = time.monotonic()
+            self.file.flush()
+            self.index.flush()
+
+    def close(self):
+        atexit.unregister(self.close)
+
+        with self.lock:
+            if self.file.closed:
+                return
+
+            if os.getpid() == self.pid:
+                self._end_checkpoint()
+            self.file.close()
+            self.index.close()
+
+
+class BuildProgress(object):
+    """ Progress of the bitbake tasks of a build, parsed from the output of
+        the kas command, for both the setscene tasks (restoring the sstate
+        cache) and the tasks run afterwards.
+
+        While the build is running, the progress, the throughput of the
+        current phase over the last THROUGHPUT_WINDOW seconds and the
+        estimated time to complete its remaining tasks are written at most
+        every UPDATE_INTERVAL seconds to the JSON status file and/or the
+        Prometheus metrics file. Each file is replaced atomically, so is never
+        read partially written """
+
+    UPDATE_INTERVAL = 5.0
+    THROUGHPUT_WINDOW = 300.0
+
+    # Task counters printed by bitbake, both in its log messages and in the
+    # footer of its interactive output, e.g. "Running task 12 of 3456",
+    # "Setscene tasks: 12 of 3456" and "Currently 4 running tasks (12 of
+    # 3456)", for which the first or second group is set for setscene tasks
+    PROGRESS_PATTERN = re.compile(
+        r"(?:Running (setscene )?task |(Setscene) tasks: |running tasks \()"
+        r"(\d+) of (\d+)")
+
+    # Maximum length of the partial line kept between updates
+    MAX_LINE_LENGTH = 256
+
+    PHASES = ["setscene", "task"]
+
+    METRICS = [
+        ("running", "gauge", "Whether the build is running"),
+        ("exit_code", "gauge", "Exit code of the finished build"),
+        ("start_time_seconds", "gauge",
+         "Start time of the build since the Unix epoch"),
+        ("last_update_time_seconds", "gauge",
+         "Time of the last progress update since the Unix epoch"),
+        ("tasks_started", "gauge", "Number of bitbake tasks started"),
+        ("tasks_planned", "gauge", "Number of bitbake tasks to run"),
+        ("progress_ratio", "gauge", "Ratio of the bitbake tasks started"),
+        ("throughput_tasks_per_second", "gauge",
+         "Rate at which the bitbake tasks are started"),
+        ("eta_seconds", "gauge",
+         "Estimated time to start the remaining tasks of the current"
+         " phase"),
+    ]
+
+    def __init__(self, build, status_file=None, metrics_file=None):
+        self.build = build
+        self.status_file = status_file
+        self.metrics_file = metrics_file
+
+        self.state = "pending"
+        self.exit_code = None
+        self.start_time = None
+        self.last_update = None
+        self.phase = None
+        self.started = dict.fromkeys(self.PHASES, 0)
+        self.planned = dict.fromkeys(self.PHASES, 0)
+        self.samples = {phase: collections.deque() for phase in self.PHASES}
+        self.partial_line = ""
+
+    def start(self):
+        self.state = "running"
+        self.start_time = time.time()
+        self.publish()
+
+    def finish(self, returncode):
+        self.state = "succeeded" if returncode == 0 else "failed"
+        self.exit_code = returncode
+        self.publish()
+
+    def update(self, text):
+        """ Parse the task counters from the complete lines of text, and
+            publish the progress if UPDATE_INTERVAL has passed """
+
+        lines = self.partial_line + text
+        end = max(lines.rfind("\n"), lines.rfind("\r")) + 1
+        self.partial_line = lines[end:][-self.MAX_LINE_LENGTH:]
+
+        counters = {}
+        for setscene, setscene_footer, started, planned in \
+                self.PROGRESS_PATTERN.findall(lines, 0, end):
+            phase = "setscene" if setscene or setscene_footer else "task"
+            counters[phase] = (started, planned)
+
+        now = time.monotonic()
+        for phase in self.PHASES:
+            if phase not in counters:
+                continue
+
+            started, planned = map(int, counters[phase])
+            samples = self.samples[phase]
+
+            # A new bitbake command restarts the counters
+            if started < self.started[phase]:
+                samples.clear()
+
+            self.phase = phase
+            self.started[phase] = started
+            self.planned[phase] = planned
+            samples.append((now, started))
+            while (len(samples) > 2 and
+                   samples[1][0] <= now - self.THROUGHPUT_WINDOW):
+                samples.popleft()
+
+        if (self.last_update is None or
+                now - self.last_update >= self.UPDATE_INTERVAL):
+            self.publish()
+
+    def get_throughput(self, phase):
+        samples = self.samples[phase]
+        if len(samples) < 2 or samples[-1][0] == samples[0][0]:
+            return None
+
+        return ((samples[-1][1] - samples[0][1]) /
+                (samples[-1][0] - samples[0][0]))
+
+    def get_eta(self):
+        if self.phase is None or self.state != "running":
+            return None
+
+        throughput = self.get_throughput(self.phase)
+        if not throughput:
+            return None
+
+        return (self.planned[self.phase] - self.started[self.phase]) / \
+            throughput
+
+    def get_status(self):
+        phases = {}
+        for phase in self.PHASES:
+            planned = self.planned[phase]
+            phases[phase] = {
+                "started": self.started[phase],
+                "planned": planned,
+                "progress": self.started[phase] / planned if planned else None,
+                "throughput": self.get_throughput(phase),
+            }
+
+        return {
+            "build": self.build,
+            "state": self.state,
+            "exit_code": self.exit_code,
+            "start_time": self.start_time,
+            "update_time": time.time(),
+            "phase": self.phase,
+            "phases": phases,
+            "eta_seconds": self.get_eta(),
+        }
+
+    def format_metrics(self, status):
+        values = {
+            "running": [({}, int(status["state"] == "running"))],
+            "exit_code": [({}, status["exit_code"])],
+            "start_time_seconds": [({}, status["start_time"])],
+            "last_update_time_seconds": [({}, status["update_time"])],
+            "eta_seconds": [({}, status["eta_seconds"])],
+        }
+        for metric, key in [("tasks_started", "started"),
+                            ("tasks_planned", "planned"),
+                            ("progress_ratio", "progress"),
+                            ("throughput_tasks_per_second", "throughput")]:
+            values[metric] = [({"phase": phase}, details[key])
+                              for phase, details in status["phases"].items()]
+
+        build_label = self.build.replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n")
+
+        lines = []
+        for metric, metric_type, description in self.METRICS:
+            name = f"kas_runner_build_{metric}"
+            samples = [(labels, value) for labels, value in values[metric]
+                       if value is not None]
+            if not samples:
+                continue
+
+            lines.append(f"# HELP {name} {description}.")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                labels_string = "".join(f',{label}="{label_value}"'
+                                        for label, label_value
+                                        in labels.items())
+                lines.append(f'{name}{{build="{build_label}"'
+                             f'{labels_string}}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    # Replace the file with the given contents, so that it is never read
+    # partially written
+    def write_file(self, path, contents):
+        mk_newdir(os.path.dirname(path))
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as tmp_file:
+            tmp_file.write(contents)
+        os.replace(tmp_path, path)
+
+    def publish(self):
+        self.last_update = time.monotonic()
+        status = self.get_status()
+
+        try:
+            if self.status_file:
+                self.write_file(self.status_file,
+                                json.dumps(status, indent=4) + "\n")
+            if self.metrics_file:
+                self.write_file(self.metrics_file,
+                                self.format_metrics(status))
+        except OSError as e:
+            # The build is not stopped by a failure to report its progress
+            print(f"WARNING: Cannot write the build progress: {e}",
+                  file=sys.tee)
+            self.status_file = None
+            self.metrics_file = None
+
+
 if __name__ == "__main__":
     main()
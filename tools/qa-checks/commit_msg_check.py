@@ -9,8 +9,10 @@ This QA-check module runs on one or more git repositories (given by the
 provided 'paths' list variable), in order to validate that commit messages
 adhere to the project's expected commit message format.
 
-The check currently validates the message of the currently checked out HEAD
-only.
+The commit messages to validate are given by the 'commits' variable, as the
+latest N commits, a list of commits, or revision ranges and date limits. For
+each repository, all requested messages are read and validated in a single
+streamed pass of 'git log'.
 
 Validation of commit message:
     * Title (first line) is not blank
@@ -22,16 +24,25 @@ Validation of commit message:
     * A sign-off is included in the message, with the following format:
       "Signed-off-by: Name <valid@email.dom>"
       The specified email must also pass validation as provided by the
-      "email_validator" Python package
+      "email_validator" Python package. By default only the syntax of the
+      address is validated, without network access. Addresses given by the
+      "sign_off_allow_list" variable (and optionally those within each
+      repository's .mailmap file) are accepted without validation, and
+      validation results are cached between runs using the same version of
+      email_validator.
 
 Any failure will be logged along with the particular validation that failed.
 """
 
 import email
+import importlib.metadata
+import importlib.util
+import json
 import logging
 import os
 import re
 import subprocess
+import tempfile
 import urllib
 
 import common
@@ -70,13 +81,37 @@ class CommitMsgCheck(abstract_check.AbstractCheck):
                 "commits",
                 default="-1",
                 message=("Defines the commit messages to check. Can be"
-                         " defined in one of two formats: '-N' to"
-                         " check the latest N commit messages, or"
+                         " defined in one of three formats: '-N' to"
+                         " check the latest N commit messages,"
                          " 'commit1(,commit2,...)' as a string list of"
-                         " commits to check. The commits must be valid"
-                         " when passed to the 'git show' command, for"
-                         " example a commit SHA or a relative commit"
-                         " like HEAD~2.")
+                         " commits to check, or 'range(,--since=DATE,...)'"
+                         " as a string list of revision ranges and date"
+                         " limits. The commits must be valid when passed to"
+                         " the 'git log' command, for example a commit SHA,"
+                         " a relative commit like HEAD~2, a range like"
+                         " origin/main..HEAD, or --since='2 weeks ago'.")
+            ),
+            abstract_check.CheckSetting(
+                "check_deliverability",
+                default=False,
+                message=("If true, also check that the domain of each"
+                         " sign-off email address can receive email, which"
+                         " requires DNS lookups (default: False, only the"
+                         " address syntax is validated).")
+            ),
+            abstract_check.CheckSetting(
+                "sign_off_allow_list",
+                is_list=True,
+                default=[],
+                message=("Email addresses that are accepted in a sign-off"
+                         " without validation.")
+            ),
+            abstract_check.CheckSetting(
+                "use_mailmap",
+                default=False,
+                message=("If true, email addresses within the .mailmap file"
+                         " of each target Git repository are accepted in a"
+                         " sign-off without validation (default: False).")
             )
         ]
 
@@ -84,35 +119,58 @@ class CommitMsgCheck(abstract_check.AbstractCheck):
         self.logger = logger
         self.__dict__.update(kwargs)
 
+        self.allowed_addresses = set()
+        self.email_cache = dict()
+        self.email_cache_changed = False
+        self.email_cache_path = None
+        self.email_validator_version = None
+
     def get_pip_dependencies(self):
         """ For email validation, this checker requires the 'email_validator'
             package from pypi. """
         return ["email_validator"]
 
     def parse_commits_str(self, commits_str):
-        """ Convert the commits that the user requested into a list of commits
-            that may be checked one at a time by being passed to the 'git show'
-            command.
+        """ Convert the commits that the user requested into the arguments to
+            pass to the 'git log' command, and a list of labels to identify
+            each commit in error messages (or None if the commit SHA should be
+            used).
             Acceptable formats are:
               -N
               SHA1(,SHA2,...)
               HEAD~1(,HEAD~2,...)
+              BASE..TIP(,--since=DATE,...)
         """
 
         try:
 
-            commits = []
-            if commits_str.startswith("-"):
-                count = int(commits_str.split("-")[1])
+            if re.fullmatch(r"-\d+", commits_str.strip()):
+                count = int(commits_str.strip()[1:])
 
-                for i in range(count):
-                    commits.append(f"HEAD~{i}")
+                # Follow first parents only, as HEAD~N does
+                args = ["-n", str(count), "--first-parent", "HEAD"]
+                labels = [f"HEAD~{i}" for i in range(count)]
 
             else:
                 commits = commits_str.split(",")
 
                 # Remove any blank commits
-                commits = [commit for commit in commits if commit]
+                commits = [commit.strip() for commit in commits
+                           if commit.strip()]
+
+                if any(".." in commit or commit.startswith("--")
+                       for commit in commits):
+                    # Walk the revision ranges, from HEAD if only date limits
+                    # are given
+                    args = commits
+                    if all(commit.startswith("--") for commit in commits):
+                        args.append("HEAD")
+                    labels = None
+
+                else:
+                    # Show exactly the given commits, in the given order
+                    args = ["--no-walk=unsorted"] + commits
+                    labels = commits
 
         except Exception as e:
             self.logger.error(("Invalid format for the desired commits to"
@@ -121,7 +179,191 @@ class CommitMsgCheck(abstract_check.AbstractCheck):
             self.logger.error(f"Exception was: {type(e)} {e}")
             exit(1)
 
-        return commits
+        return args, labels
+
+    def iter_commit_messages(self, cmd):
+        """ Run the 'git log' command and yield a (SHA, message) tuple for each
+            commit as its output is streamed. Raises CalledProcessError if the
+            command fails. """
+
+        # Commits are separated by NUL characters (via -z), and the SHA is
+        # separated from the raw message by the first newline. Arguments are
+        # always interpreted as revisions rather than paths (via --)
+        cmd = cmd + ["-z", "--format=%H%n%B", "--"]
+
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(cmd,
+                                       stdout=subprocess.PIPE,
+                                       stderr=stderr)
+
+            remainder = b""
+            for chunk in iter(lambda: process.stdout.read(65536), b""):
+                *records, remainder = (remainder + chunk).split(b"\0")
+
+                for record in records:
+                    sha, _, message = record.decode().partition("\n")
+                    yield sha, message.strip()
+
+            if remainder:
+                sha, _, message = remainder.decode().partition("\n")
+                yield sha, message.strip()
+
+            process.wait()
+
+            if process.returncode != 0:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(process.returncode,
+                                                    cmd,
+                                                    stderr=stderr.read())
+
+    def get_mailmap_addresses(self, path):
+        """ Return the set of email addresses in the .mailmap file of the Git
+            repository at path, if it has one. """
+
+        addresses = set()
+        mailmap_path = os.path.join(path, ".mailmap")
+
+        if os.path.isfile(mailmap_path):
+            with open(mailmap_path, "r") as f:
+                for line in f:
+                    line = line.partition("#")[0]
+                    addresses.update(addr.strip().lower() for addr
+                                     in re.findall(r"<([^>]*)>", line))
+
+        return addresses
+
+    def load_email_cache(self):
+        """ Load previously cached email address validation results for the
+            current validation mode from the QA-checks cache directory. The
+            results are discarded if they were produced by a different version
+            of email_validator, as its validation rules may have changed. """
+
+        mode = "deliverability" if self.check_deliverability else "syntax"
+
+        try:
+            self.email_validator_version = importlib.metadata.version(
+                "email_validator")
+
+            cache_dir = common.get_cache_dir(self.name)
+            self.email_cache_path = os.path.join(cache_dir,
+                                                 f"emails-{mode}.json")
+
+            if os.path.isfile(self.email_cache_path):
+                with open(self.email_cache_path, "r") as f:
+                    cache = json.load(f)
+
+                if (cache.get("email_validator_version") ==
+                        self.email_validator_version):
+                    self.email_cache = cache["emails"]
+                else:
+                    self.logger.debug("Discarding the email cache of a"
+                                      " different email_validator version")
+
+        except (OSError, ValueError, KeyError, AttributeError,
+                importlib.metadata.PackageNotFoundError) as e:
+            self.logger.debug(f"Could not load the email cache: {e}")
+            self.email_cache = dict()
+
+    def save_email_cache(self):
+        """ Write the email address validation results to the QA-checks cache
+            directory, if any new addresses were validated. """
+
+        if not self.email_cache_changed or self.email_cache_path is None:
+            return
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.email_cache_path))
+            with os.fdopen(fd, "w") as f:
+                json.dump({"email_validator_version":
+                           self.email_validator_version,
+                           "emails": self.email_cache},
+                          f, indent=0, sort_keys=True)
+            os.replace(tmp_path, self.email_cache_path)
+
+        except OSError as e:
+            self.logger.debug(f"Could not save the email cache: {e}")
+
+    def is_valid_address(self, addr):
+        """ Return True if the email address is allowed or passes validation,
+            using the cached result where available. """
+
+        import email_validator
+
+        if addr.lower() in self.allowed_addresses:
+            return True
+
+        if addr not in self.email_cache:
+            try:
+                email_validator.validate_email(
+                    addr,
+                    check_deliverability=self.check_deliverability)
+                self.email_cache[addr] = True
+            except email_validator.EmailNotValidError:
+                self.email_cache[addr] = False
+
+            self.email_cache_changed = True
+
+        return self.email_cache[addr]
+
+    def validate_message(self, target, message, errors):
+        """ Validate the commit message, appending any errors to the list,
+            prefixed with the target that identifies the commit. """
+
+        # Check that all sign offs have a valid format
+
+        correct_sign_off = "Signed-off-by: Name <valid@email.dom>"
+        signed_off = "Signed-off-by:"
+        matches = re.findall(fr"(^.*?{signed_off}.*?$)",
+                             message,
+                             re.MULTILINE)
+
+        if not matches:
+            errors.append((f"{target}:Could not find a '{signed_off}'"
+                           f" line in the commit message."))
+            return
+
+        for line in matches:
+
+            name, addr = email.utils.parseaddr(line)
+
+            # Check name is found and email address is valid
+            if name == "" or not self.is_valid_address(addr):
+                errors.append((f"{target}:Failed sign-off validation:"
+                               f" '{line}'. Must be formed as"
+                               f" '{correct_sign_off}'"))
+
+        # Iterate over the full message and validate the other aspects
+
+        for idx, line in enumerate(message.split("\n")):
+
+            if idx == 0:
+                if line == "":
+                    errors.append(f"{target}:Message title is empty")
+                elif len(line) > int(self.title_length):
+                    errors.append((f"{target}:Title is too long"
+                                   f" ({len(line)} >"
+                                   f" {self.title_length}):"
+                                   f" '{line}'"))
+
+            elif idx == 1 and line != "":
+                errors.append((f"{target}:The message title must be"
+                               " followed by a blank line"))
+
+            elif idx > 1 and len(line) > int(self.body_length):
+
+                # Ignore lines that are URLs, which are allowed to
+                # break the maximum character length
+                try:
+                    if urllib.parse.urlparse(line.strip()):
+                        continue
+                except ValueError:
+                    # Not a value URL
+                    pass
+
+                errors.append((f"{target}:Line {idx} is too long"
+                               f" ({len(line)} > {self.body_length}):"
+                               f"'{line}'"))
 
     def run(self):
         """ Run the git commit message check.
@@ -130,12 +372,10 @@ class CommitMsgCheck(abstract_check.AbstractCheck):
 
         self.logger.debug(f"Running {self.name} check.")
 
-        try:
-            import email_validator
-        except ImportError:
+        if importlib.util.find_spec("email_validator") is None:
             self.logger.error("FAIL")
-            self.logger.error((f"Failed to import the Python email_validator"
-                               " module."))
+            self.logger.error("Could not find the Python email_validator"
+                              " module.")
             return 1
 
         script = "git"
@@ -146,103 +386,62 @@ class CommitMsgCheck(abstract_check.AbstractCheck):
             self.logger.error(f"Could not find {script}")
             return 1
 
-        commits = self.parse_commits_str(self.commits)
+        log_args, labels = self.parse_commits_str(self.commits)
+
+        self.check_deliverability = str(self.check_deliverability).lower() in [
+            "true", "1", "yes"]
+        self.use_mailmap = str(self.use_mailmap).lower() in [
+            "true", "1", "yes"]
+
+        self.allowed_addresses = set(addr.strip().lower() for addr
+                                     in self.sign_off_allow_list or [])
+        self.load_email_cache()
 
         errors = []
 
         for path in self.paths:
 
-            if not os.path.isdir(path):
-                errors.append(f"Directory ${path} not found.")
-                continue
-
             if not os.path.isabs(path):
                 path = os.path.join(self.project_root, path)
 
-            for commit in commits:
-
-                # If printing an error message, attach this to identify which
-                # commit had the error
-                target = f"{os.path.basename(path)}:{commit}"
-
-                cmd = f"{script} -C {path} show {commit} -q --format=%B"
-
-                process = subprocess.Popen(cmd,
-                                           stdout=subprocess.PIPE,
-                                           shell=True)
-                stdout, _ = process.communicate()
-                stdout = stdout.decode().strip()
-
-                if process.returncode != 0 or stdout == "":
-                    errors.append(("Failed to get a commit message using:"
-                                   f" {cmd}."))
-                    continue
-
-                # Check that all sign offs have a valid format
-
-                correct_sign_off = "Signed-off-by: Name <valid@email.dom>"
-                signed_off = "Signed-off-by:"
-                matches = re.findall(fr"(^.*?{signed_off}.*?$)",
-                                     stdout,
-                                     re.MULTILINE)
-
-                if not matches:
-                    errors.append((f"{target}:Could not find a '{signed_off}'"
-                                   f" line in the commit message."))
-                    continue
-
-                for line in matches:
-
-                    valid = True
-                    try:
-                        name, addr = email.utils.parseaddr(line)
-
-                        # Check email address
-                        email_validator.validate_email(addr)
+            if not os.path.isdir(path):
+                errors.append(f"Directory {path} not found.")
+                continue
 
-                        # Check name is found
-                        if name == "":
-                            valid = False
+            if self.use_mailmap:
+                self.allowed_addresses |= self.get_mailmap_addresses(path)
 
-                    except email_validator.EmailNotValidError:
-                        valid = False
+            cmd = [script_path, "-C", path, "log"] + log_args
 
-                    if not valid:
-                        errors.append((f"{target}:Failed sign-off validation:"
-                                       " '{line}'. Must be formed as"
-                                       f" '{correct_sign_off}'"))
+            num_commits = 0
+            try:
+                for sha, message in self.iter_commit_messages(cmd):
 
-                # Iterate over the full message and validate the other aspects
+                    # If printing an error message, attach this to identify
+                    # which commit had the error
+                    label = sha[:12]
+                    if labels is not None and num_commits < len(labels):
+                        label = labels[num_commits]
+                    target = f"{os.path.basename(path)}:{label}"
 
-                for idx, line in enumerate(stdout.split("\n")):
+                    num_commits += 1
 
-                    if idx == 0:
-                        if line == "":
-                            errors.append(f"{target}:Message title is empty")
-                        elif len(line) > int(self.title_length):
-                            errors.append((f"{target}:Title is too long"
-                                           f" ({len(line)} >"
-                                           f" {self.title_length}):"
-                                           f" '{line}'"))
+                    if message == "":
+                        errors.append(f"{target}:Commit message is empty")
+                        continue
 
-                    elif idx == 1 and line != "":
-                        errors.append((f"{target}:The message title must be"
-                                       " followed by a blank line"))
+                    self.validate_message(target, message, errors)
 
-                    elif idx > 1 and len(line) > int(self.body_length):
+            except subprocess.CalledProcessError as e:
+                stderr = e.stderr.decode().strip()
+                errors.append(("Failed to get the commit messages using:"
+                               f" {' '.join(cmd)}: {stderr}"))
+                continue
 
-                        # Ignore lines that are URLs, which are allowed to
-                        # break the maximum character length
-                        try:
-                            if urllib.parse.urlparse(line.strip()):
-                                continue
-                        except ValueError:
-                            # Not a value URL
-                            pass
+            self.logger.debug(f"Checked {num_commits} commit messages in"
+                              f" {path}")
 
-                        errors.append((f"{target}:Line {idx} is too long"
-                                       f" ({len(line)} > {self.body_length}):"
-                                       f"'{line}'"))
+        self.save_email_cache()
 
         if errors:
             self.logger.error("FAIL")
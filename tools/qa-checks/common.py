@@ -8,11 +8,18 @@
 This file provides common functionality that may be used by multiple QA-checks.
 """
 
+import codecs
 import logging
 import os
 import re
 import shutil
 
+# Size of the first block of a file read to determine whether it is binary
+BINARY_SNIFF_SIZE = 8192
+
+# Approximate number of characters read at a time when scanning text files
+TEXT_CHUNK_SIZE = 1024 * 1024
+
 
 def find_executable(logger, name, directory=None):
     """ Function that returns the correct executable for a given name. If the
@@ -44,6 +51,102 @@ def find_executable(logger, name, directory=None):
     return script_path
 
 
+def is_binary_file(path):
+    """ Function that returns True if the first block of the file contains a
+        NUL byte or is not valid UTF-8, so it should not be scanned as text.
+        """
+
+    with open(path, "rb") as f:
+        block = f.read(BINARY_SNIFF_SIZE)
+
+    if b"\0" in block:
+        return True
+
+    # The block may end part way through a multi-byte character, so decode
+    # incrementally without finalizing
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(block, final=False)
+    except UnicodeDecodeError:
+        return True
+
+    return False
+
+
+def get_text_file_skip_reason(path, max_file_size=0):
+    """ Function that returns a tuple of (log level, reason) for why the file
+        at 'path' should not be scanned as text by a QA-check, or None if it
+        should be scanned.
+        A file is skipped if it is binary, or if 'max_file_size' is non-zero
+        and the file is larger than 'max_file_size' bytes. As an oversized
+        file may be text that is then never checked, it is reported at the
+        WARNING level, while binary files are reported at the DEBUG level. """
+
+    size = os.path.getsize(path)
+    if max_file_size and size > max_file_size:
+        return (logging.WARNING,
+                (f"File size ({size} bytes) exceeds the maximum file size"
+                 f" ({max_file_size} bytes)"))
+
+    if is_binary_file(path):
+        return logging.DEBUG, "Binary file"
+
+    return None
+
+
+def iter_text_chunks(path, chunk_size=TEXT_CHUNK_SIZE):
+    """ Generator function that reads the UTF-8 text file at 'path' in chunks
+        of whole lines, so that the memory used to scan a file does not
+        depend on its size.
+
+        Yields tuples of (first_line, context_length, text), where 'text'
+        starts with the last line of the previous chunk as context, so that
+        matches spanning two lines or depending on the preceding line can be
+        found. 'context_length' is the number of characters of context and
+        'first_line' is the line number of the first line within 'text'.
+
+        Raises UnicodeDecodeError if the file cannot be decoded. """
+
+    with open(path, "r", encoding="utf-8") as f:
+        first_line = 1
+        context = ""
+
+        while True:
+            lines = f.readlines(chunk_size)
+            if not lines:
+                break
+
+            yield first_line, len(context), context + "".join(lines)
+
+            if context:
+                first_line += len(lines)
+            else:
+                first_line += len(lines) - 1
+            context = lines[-1]
+
+
+def get_cache_dir(name):
+    """ Function that returns the path to a persistent directory in which a
+        QA-check may cache data between runs, creating it if necessary.
+
+        The base directory is given by the QA_CHECKS_CACHE_DIR environment
+        variable if set, otherwise 'ewaol-qa-checks' within the user's cache
+        directory (XDG_CACHE_HOME, or ~/.cache) is used. Each check should use
+        its own 'name' subdirectory. """
+
+    base_dir = os.environ.get("QA_CHECKS_CACHE_DIR")
+
+    if not base_dir:
+        user_cache_dir = os.environ.get("XDG_CACHE_HOME")
+        if not user_cache_dir:
+            user_cache_dir = os.path.join(os.path.expanduser("~"), ".cache")
+        base_dir = os.path.join(user_cache_dir, "ewaol-qa-checks")
+
+    cache_dir = os.path.join(base_dir, name)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    return cache_dir
+
+
 def recursively_apply_check(
         path,
         check_fn,
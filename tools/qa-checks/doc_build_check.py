@@ -9,13 +9,18 @@ This QA-check module ensures that documentation builds without errors.
 
 The check runs 'doc-build.py' once using the default arguments. The defaults
 arguments can be overwritten using documentation_dir (source of documentation),
-output_dir (location of build output, use "" to create a temp dir), and
-requirements (location of pip requirements.txt).
+output_dir (location of build output, use "" to build incrementally within the
+QA-checks cache directory), requirements (location of pip requirements.txt) and
+jobs (number of parallel sphinx processes).
 
-On failure, the output from 'doc-build.py' will be logged.
+The output from 'doc-build.py' is logged at debug level as it is produced. On
+failure, the warnings and errors reported by sphinx are logged as
+file:line:type: message, or the full output if none could be extracted.
 """
 
+import json
 import logging
+import os
 import pathlib
 import subprocess
 import sys
@@ -45,9 +50,11 @@ class DocBuildCheck(abstract_check.AbstractCheck):
                 default="",
                 message=("Path to directory where generated documentation will"
                          " be placed. If the directory does not exist, it will"
-                         " be created. If set to '', then a temporary"
-                         " directory will be used and deleted after the build."
-                         " A relative file path will be considered relative to"
+                         " be created. If set to '', then the documentation"
+                         " will be built incrementally within the QA-checks"
+                         " cache directory, so only the documents changed"
+                         " since the previous check are rebuilt. A relative"
+                         " file path will be considered relative to"
                          " 'project_root'.")
             ),
             abstract_check.CheckSetting(
@@ -56,6 +63,13 @@ class DocBuildCheck(abstract_check.AbstractCheck):
                 message=("Path to pip requirements file for building the"
                          " documentation. A relative file path will be"
                          " considered relative to 'project_root'.")
+            ),
+            abstract_check.CheckSetting(
+                "jobs",
+                default="auto",
+                message=("Number of parallel processes used by sphinx to read"
+                         " and write the documents, or 'auto' for the number"
+                         " of CPUs (default: auto).")
             )
         ]
 
@@ -70,14 +84,55 @@ class DocBuildCheck(abstract_check.AbstractCheck):
         """ The doc build should install its own dependencies. """
         return []
 
+    def format_warning(self, warning):
+        """ Format a warning reported by doc-build.py, relative to the
+            project root. """
+
+        location = []
+        if warning["document"]:
+            location.append(os.path.relpath(warning["document"],
+                                            self.project_root))
+        if warning["line"] is not None:
+            location.append(str(warning["line"]))
+
+        location.append(warning["type"])
+        return f"{':'.join(location)}: {warning['message']}"
+
+    def run_doc_build(self, command):
+        """ Run doc-build.py, logging its output as it is produced. Returns
+            the return code, the output lines and the list of warnings. """
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            warnings_file = os.path.join(tmp_dir, "warnings.json")
+            command = command + ["--warnings_file", warnings_file]
+
+            self.logger.debug(f"Running command '{' '.join(command)}'")
+            process = subprocess.Popen(command,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       universal_newlines=True)
+
+            lines = []
+            for line in process.stdout:
+                line = line.rstrip()
+                if line:
+                    lines.append(line)
+                    self.logger.debug(line)
+            process.wait()
+
+            warnings = []
+            if os.path.isfile(warnings_file):
+                with open(warnings_file) as f:
+                    warnings = json.load(f)
+
+        return process.returncode, lines, warnings
+
     def run(self):
         """ Run the check.
             If no errors are found, then report PASS.
             If any errors are found, then report FAIL and print the list of
             errors. """
 
-        tmp_dir = None
-
         if not self.script.is_file():
             self.logger.error(f"Could not find {self.script}")
             return 1
@@ -95,11 +150,14 @@ class DocBuildCheck(abstract_check.AbstractCheck):
             command += ["--documentation_dir", f"{self.documentation_dir}"]
 
         if self.output_dir == "":
-            # TemporaryDirectory deletes directory on object garbage collection
-            tmp_dir = tempfile.TemporaryDirectory()
-            self.output_dir = tmp_dir.name
-            self.logger.debug("Building documentation into temporary"
-                              " directory")
+            # Keep the output and the cached build environment between runs,
+            # so that only the changed documents are rebuilt
+            cache_dir = common.get_cache_dir(self.name)
+            self.output_dir = os.path.join(cache_dir, "html")
+            command += ["--incremental",
+                        "--doctree_dir", os.path.join(cache_dir, "doctrees")]
+            self.logger.debug("Building documentation incrementally into the"
+                              f" cache directory {cache_dir}")
         if self.output_dir is not None:
             self.output_dir = str(
                 (project_root_path / self.output_dir).resolve())
@@ -110,21 +168,21 @@ class DocBuildCheck(abstract_check.AbstractCheck):
                 (project_root_path / self.requirements).resolve())
             command += ["--requirements", f"{self.requirements}"]
 
-        self.logger.debug(f"Running command '{' '.join(command)}'")
-        process = subprocess.run(command,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.STDOUT)
+        if self.jobs is not None:
+            command += ["--jobs", f"{self.jobs}"]
 
-        stdout = process.stdout.decode()
+        returncode, lines, warnings = self.run_doc_build(command)
 
         errors = []
-        if process.returncode != 0:
-            for line in stdout.strip().split("\n"):
-                if line.strip() != "":
-                    errors.append(line)
+        if returncode != 0:
+            errors = [self.format_warning(warning) for warning in warnings]
+            if len(errors) == 0:
+                # The failure was not reported by sphinx (e.g. the virtual
+                # environment could not be created), so log all the output
+                errors = lines
             if len(errors) == 0:
                 # We failed but got no stdout, don't ignore this error!
-                errors = [f"Unknown error (rc = {process.returncode})"]
+                errors = [f"Unknown error (rc = {returncode})"]
 
         if errors:
             self.logger.error("FAIL")
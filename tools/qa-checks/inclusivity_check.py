@@ -37,6 +37,106 @@ import common
 import abstract_check
 
 
+def is_word_boundary(text, position):
+    """ Return True if the position within the text is at a word boundary, as
+        defined by the regex '\\b' special sequence. """
+
+    def is_word_char(char):
+        return char.isalnum() or char == "_"
+
+    before = position > 0 and is_word_char(text[position - 1])
+    after = position < len(text) and is_word_char(text[position])
+
+    return before != after
+
+
+class TermAutomaton():
+    """ Aho-Corasick automaton that finds all occurrences of a set of terms
+        within a text in a single pass, independent of the number of terms.
+
+        Any whitespace within a term matches one or more whitespace characters
+        in the text, so a multi-word term may be split across lines. """
+
+    def __init__(self, terms):
+        self.transitions = [dict()]
+        self.fail = [0]
+        self.output = [list()]
+        self.longest_term = 0
+
+        for term in terms:
+            self.add_term(term)
+
+        self.build_failure_links()
+
+    def add_term(self, term):
+        normalized = " ".join(term.split())
+        if not normalized:
+            return
+
+        state = 0
+        for char in normalized:
+            if char not in self.transitions[state]:
+                self.transitions.append(dict())
+                self.fail.append(0)
+                self.output.append(list())
+                self.transitions[state][char] = len(self.transitions) - 1
+            state = self.transitions[state][char]
+
+        self.output[state].append((term, len(normalized)))
+        self.longest_term = max(self.longest_term, len(normalized))
+
+    def build_failure_links(self):
+        queue = collections.deque(self.transitions[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for char, next_state in self.transitions[state].items():
+                queue.append(next_state)
+
+                fail_state = self.fail[state]
+                while fail_state and char not in self.transitions[fail_state]:
+                    fail_state = self.fail[fail_state]
+
+                self.fail[next_state] = self.transitions[fail_state].get(
+                    char, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def finditer(self, text):
+        """ Yield (term, start, end) for each occurrence of a term within the
+            text, where start and end are positions within the text. """
+
+        transitions = self.transitions
+        fail = self.fail
+        output = self.output
+
+        # The text positions of the most recent characters fed to the
+        # automaton, so that the start position of a match can be recovered
+        positions = collections.deque(maxlen=self.longest_term)
+
+        state = 0
+        previous_space = False
+
+        for position, char in enumerate(text):
+
+            if char.isspace():
+                if previous_space:
+                    continue
+                previous_space = True
+                char = " "
+            else:
+                previous_space = False
+
+            positions.append(position)
+
+            while state and char not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(char, 0)
+
+            for term, length in output[state]:
+                yield term, positions[-length], position + 1
+
+
 class InclusivityCheck(abstract_check.AbstractCheck):
 
     name = "inclusivity"
@@ -69,6 +169,14 @@ class InclusivityCheck(abstract_check.AbstractCheck):
                          " that the check will search for. A relative file"
                          " path will be considered relative to"
                          " 'project_root'.")
+            ),
+            abstract_check.CheckSetting(
+                "max_file_size",
+                default=10485760,
+                message=("Maximum size in bytes of a file to check. Larger"
+                         " files are skipped with a warning, while binary"
+                         " files are always skipped. Set to 0 to check files"
+                         " of any size.")
             )
         ]
 
@@ -78,6 +186,7 @@ class InclusivityCheck(abstract_check.AbstractCheck):
 
         self.num_files_checked = 0
         self.non_inclusive_terms = list()
+        self.term_automaton = None
 
     def get_pip_dependencies(self):
         """ There are no additional Python package dependencies required. """
@@ -90,10 +199,43 @@ class InclusivityCheck(abstract_check.AbstractCheck):
 
         with open(non_inclusive_language_path) as f:
             for line in f:
-                terms_list.append(line.strip())
+                if line.strip():
+                    terms_list.append(line.strip())
 
         return terms_list
 
+    def check_text(self, text, first_line, context_length, errors_with_lines):
+        """ Find any non-inclusive terms within a chunk of text starting at
+            line 'first_line' of a file, and add their line numbers to
+            'errors_with_lines'. Matches found entirely within the first
+            'context_length' characters have already been reported. """
+
+        # Get the positions of all the newlines in the text, so that we can
+        # determine the line number of any matches
+        newline_positions = [mat.start() for mat in re.finditer("\n", text)]
+
+        for term, start, end in self.term_automaton.finditer(text):
+
+            if end <= context_length:
+                continue
+
+            if not (is_word_boundary(text, start) and
+                    is_word_boundary(text, end)):
+                continue
+
+            # Find the nearest newline before the match
+            line = bisect.bisect_left(newline_positions, start)
+
+            # Check if it is tagged with an exception, on the same line or the
+            # immediately preceding line
+            preceding_start = 0
+            if line > 1:
+                preceding_start = newline_positions[line - 2]
+
+            preceding_text = text[preceding_start:start]
+            if "inclusivity-exception" not in preceding_text.lower():
+                errors_with_lines[term].add(str(first_line + line))
+
     def run_inclusivitycheck(self, path, file_errors):
         """ Run the check, and return any non-inclusive terms as a dict mapping
             the filepath to a list of terms and their line numbers.
@@ -103,41 +245,29 @@ class InclusivityCheck(abstract_check.AbstractCheck):
 
         errors_with_lines = collections.defaultdict(set)
 
-        text = ""
+        skip_reason = common.get_text_file_skip_reason(path,
+                                                       self.max_file_size)
+        if skip_reason is not None:
+            level, reason = skip_reason
+            self.logger.log(level, f"Skipping {rel_path}: {reason}")
+            return
+
         try:
-            with open(path, 'r') as f:
-                text = f.read()
+            for first_line, context_length, text in common.iter_text_chunks(
+                    path):
+                self.check_text(text, first_line, context_length,
+                                errors_with_lines)
+
         except UnicodeDecodeError as e:
             file_errors[rel_path] = [("Couldn't process file due to"
                                      " UnicodeDecodeError")]
             return
 
-        # Get the positions of all the newlines in the text, so that we can
-        # determine the line number of any matches
-        newline_positions = [mat.start() for mat in re.finditer("\n", text)]
-
-        for term in self.non_inclusive_terms:
-
-            search = fr"\b{term}\b"
-            if " " in term:
-                multi_line_search = term.replace(" ", r"\b\s*\b")
-                search = f"{term}|{multi_line_search}"
-
-            for match in re.finditer(search, text, re.MULTILINE):
-
-                # Find the nearest newline before the match
-                line = bisect.bisect_left(newline_positions, match.start()) + 1
-
-                # Check if it is tagged with an exception
-                preceeding_text = text[newline_positions[line-3]:match.start()]
-                if "inclusivity-exception" not in preceeding_text.lower():
-                    errors_with_lines[term].add(str(line))
-
         errors = set()
 
         # Report any non-inclusive terminology with their line numbers
         for word, lines_set in errors_with_lines.items():
-            error_msg = f"{','.join(lines_set)}:{word}"
+            error_msg = f"{','.join(sorted(lines_set, key=int))}:{word}"
             errors.add(error_msg)
 
         if errors_with_lines:
@@ -176,6 +306,9 @@ class InclusivityCheck(abstract_check.AbstractCheck):
                               " so check cannot be performed.")
             return 1
 
+        self.term_automaton = TermAutomaton(self.non_inclusive_terms)
+        self.max_file_size = int(self.max_file_size)
+
         file_errors = dict()
 
         for path in self.paths:
@@ -17,16 +17,35 @@ each set given as an element of the user-provided 'kas_configs' list. For each
 set, all target layers (as given by the user-provided 'test_layers' list) are
 checked.
 
+The layers of each set of kas build configs are first resolved one set at a
+time, as kas checks out the layer repositories into the shared project root.
+The yocto-check-layer script is then run for up to 'jobs' sets concurrently,
+each within its own build directory, while the kas repository checkouts
+which precede it are still run one at a time. As the layer repositories are
+shared, the sets of kas build configs should pin the same revisions of any
+common layers.
+
+Resolving the layers requires a kas container and a bitbake parse, so the
+layers of each set of kas build configs are cached. The cache is keyed by the
+content of the kas build config files (including any files that they include
+from the project) and the checked out revisions of their layer repositories,
+so that the layers are only resolved again when either of these change.
+
 Any failure found by yocto-check-layer will be output, detailing the kas build
 configs and failing layer, as well as the particular test that failed and the
 error message as produced by the script.
 """
 
 import collections
+import concurrent.futures
+import hashlib
+import json
 import logging
 import os
 import re
 import subprocess
+import tempfile
+import threading
 
 import common
 import abstract_check
@@ -37,6 +56,10 @@ class LayerCheck(abstract_check.AbstractCheck):
 
     name = "layer"
 
+    # Line printed by the kas shell command of the layer check once kas has
+    # set up the layer repositories, before running yocto-check-layer
+    CHECKOUT_DONE_MARKER = "LAYER_CHECK_CHECKOUT_DONE"
+
     @staticmethod
     def get_vars():
         return [
@@ -67,6 +90,20 @@ class LayerCheck(abstract_check.AbstractCheck):
                 message=("The docker container network mode to pass to the"
                          " kas-runner.py script. If not set, the default value"
                          " set by the kas-runner.py script will be used.")
+            ),
+            abstract_check.CheckSetting(
+                "jobs",
+                default=0,
+                message=("Maximum number of sets of kas config files to run"
+                         " the layer check on concurrently. If 0, all sets"
+                         " are run concurrently, up to the number of CPUs"
+                         " (default: 0).")
+            ),
+            abstract_check.CheckSetting(
+                "cache_layers",
+                default=True,
+                message=("If true, cache the layers resolved for each set of"
+                         " kas config files between runs (default: True).")
             )
         ]
 
@@ -77,14 +114,128 @@ class LayerCheck(abstract_check.AbstractCheck):
         self.script = os.path.join(os.path.dirname(__file__),
                                    "../build/kas-runner.py")
 
+        self.layers_cache = dict()
+        self.layers_cache_changed = False
+
     def get_pip_dependencies(self):
-        """ There are no non-standard Python package dependencies required to
-            run the check. """
-        return []
+        """ This class requires the 'pyyaml' package from pip to read the kas
+            config files when caching their layers. """
+        return ["pyyaml"]
+
+    def get_git_revision(self, path):
+        """ Return the commit checked out in the Git repository at path, or
+            None if it is not a Git repository. """
+
+        process = subprocess.run(["git", "-C", path, "rev-parse", "HEAD"],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL)
+
+        if process.returncode != 0:
+            return None
+
+        return process.stdout.decode().strip()
+
+    def get_kas_config_key(self, kas_config):
+        """ Return a digest identifying the layers of the build given by the
+            kas config files: the content of each kas config file and of the
+            files it includes from the project, and the checked out revision
+            of each repository with a URL. Returns None if the kas config
+            files could not be read. """
+
+        import yaml
+
+        digest = hashlib.sha256()
+        repos = dict()
+
+        paths = [os.path.join(self.project_root, path)
+                 for path in kas_config.split(":")]
+        read_paths = set()
+
+        try:
+            while paths:
+                path = os.path.normpath(paths.pop(0))
+                if path in read_paths:
+                    continue
+                read_paths.add(path)
+
+                with open(path, "rb") as f:
+                    content = f.read()
+
+                digest.update(path.encode() + b"\0" + content + b"\0")
+
+                kas_file = yaml.safe_load(content) or dict()
+
+                # kas resolves included files relative to the root of the
+                # repository containing the including file. Files included
+                # from other repositories are identified by the revision of
+                # that repository.
+                header = kas_file.get("header") or dict()
+                for include in header.get("includes") or []:
+                    if isinstance(include, str):
+                        paths.append(os.path.join(self.project_root,
+                                                  include))
+
+                for name, repo in (kas_file.get("repos") or dict()).items():
+                    repos.setdefault(name, dict()).update(repo or dict())
+
+        except (OSError, yaml.YAMLError, AttributeError) as e:
+            self.logger.debug(f"Could not read {kas_config}: {e}")
+            return None
+
+        # kas checks out each repository with a URL into the project root
+        for name, repo in sorted(repos.items()):
+            if "url" in repo:
+                repo_path = os.path.join(self.project_root,
+                                         repo.get("path") or name)
+                revision = self.get_git_revision(repo_path)
+                digest.update(f"{name}:{revision}\0".encode())
+
+        return digest.hexdigest()
+
+    def load_layers_cache(self):
+        """ Load the previously resolved layers from the QA-checks cache
+            directory. """
+
+        try:
+            cache_path = os.path.join(common.get_cache_dir(self.name),
+                                      "bblayers.json")
+
+            if os.path.isfile(cache_path):
+                with open(cache_path, "r") as f:
+                    self.layers_cache = json.load(f)
+
+        except (OSError, ValueError) as e:
+            self.logger.debug(f"Could not load the layers cache: {e}")
+            self.layers_cache = dict()
+
+    def save_layers_cache(self):
+        """ Write the resolved layers to the QA-checks cache directory, if any
+            layers were resolved. """
+
+        if not self.layers_cache_changed:
+            return
+
+        try:
+            cache_dir = common.get_cache_dir(self.name)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.layers_cache, f, indent=0, sort_keys=True)
+            os.replace(tmp_path, os.path.join(cache_dir, "bblayers.json"))
+
+        except OSError as e:
+            self.logger.debug(f"Could not save the layers cache: {e}")
 
     def get_build_layers(self, kas_config, errors):
         """ This function passes the kas config files to kas, and extracts the
-            resulting Yocto layers (according to the BBLAYERS variable). """
+            resulting Yocto layers (according to the BBLAYERS variable).
+            If the layers for the kas config files are cached, they are
+            returned without running kas. """
+
+        if self.cache_layers:
+            key = self.get_kas_config_key(kas_config)
+            if key in self.layers_cache:
+                self.logger.debug(f"Using the cached layers for {kas_config}")
+                return self.layers_cache[key]
 
         kas_cmd = "shell --command \\\"bitbake-getvar BBLAYERS\\\""
         if self.network_mode:
@@ -125,167 +276,256 @@ class LayerCheck(abstract_check.AbstractCheck):
 
         layers = lines[0].strip().split()
 
+        # kas may have checked out the repositories, so get the key again
+        if self.cache_layers:
+            key = self.get_kas_config_key(kas_config)
+            if key is not None:
+                self.layers_cache[key] = layers
+                self.layers_cache_changed = True
+
         return layers
 
-    def run(self):
-        """ Run the yocto-check-layer function by invoking the kas-runner.py
-            tools. The check is executed independently for each set of
-            user-defined kas config files.
+    def get_layer_check_command(self, kas_config, errors):
+        """ This function resolves the layers of the build given by the kas
+            config files, and returns the kas-runner.py command to run the
+            yocto-check-layer script on the target layers, or None if the
+            layers could not be resolved. """
 
-            If no errors are found, then report PASS.
-            If any errors are found, then report FAIL and list the layers which
-            failed, the tests that they failed on and the fail message(s). """
+        # Get the test layer directories as defined within the build given
+        # by the kas config YAML files
+        bblayers = self.get_build_layers(kas_config, errors)
 
-        self.logger.info(f"Running {self.name} check, this may take a while.")
+        if bblayers is None:
+            return None
 
-        script_name = "kas-runner.py"
-        script_dir = os.path.join(os.path.dirname(__file__), "../build/")
-        self.script = common.find_executable(self.logger,
-                                             script_name,
-                                             script_dir)
+        test_bblayers = list()
+        for test_layer in self.test_layers:
+            bblayer = next((layer for layer in bblayers
+                           if test_layer == os.path.basename(layer)),
+                           None)
 
-        if self.script is None:
-            self.logger.error("FAIL")
-            self.logger.error(f"Could not find {script_name}.")
-            return 1
+            if bblayer is None:
+                errors[kas_config].append(
+                    f"{test_layer}: Could not find this layer within the"
+                    " bitbake build.")
+                continue
 
-        errors = collections.defaultdict(list)
+            test_bblayers.append(bblayer)
 
-        for kas_config in self.kas_configs:
+        if len(test_bblayers) != len(self.test_layers):
+            return None
 
-            # Get the test layer directories as defined within the build given
-            # by the kas config YAML files
-            bblayers = self.get_build_layers(kas_config, errors)
+        dep_bblayers = [layer for layer in bblayers
+                        if layer not in test_bblayers]
 
-            if bblayers is None:
-                continue
+        # Create the command with the dependent layers as --dependency and
+        # the test layers as positional arguments
 
-            test_bblayers = list()
-            for test_layer in self.test_layers:
-                bblayer = next((layer for layer in bblayers
-                               if test_layer == os.path.basename(layer)),
-                               None)
+        dependencies = "--dependency " + " ".join(dep_bblayers)
+        test_layers_str = " ".join(test_bblayers)
 
-                if bblayer is None:
-                    errors[kas_config].append(
-                        f"{test_layer}: Could not find this layer within the"
-                        " bitbake build.")
-                    continue
+        # The yocto-check-layer-wrapper script will create a temporary
+        # directory in the parent directory of BUILDDIR
+        # So set BUILDDIR to a subdirectory of the build directory of these
+        # kas config files, which kas-runner.py names after them, so that
+        # concurrent layer checks do not share a BUILDDIR
+        shell_cmd = (f"echo {self.CHECKOUT_DONE_MARKER} &&"
+                     " mkdir -p /work/kas_build_dir/layer_check &&"
+                     " BUILDDIR=/work/kas_build_dir/layer_check"
+                     " BB_NO_NETWORK=1"
+                     f" yocto-check-layer-wrapper {test_layers_str}"
+                     f" {dependencies} --no-auto-dependency")
 
-                test_bblayers.append(bblayer)
+        if self.machines:
+            shell_cmd += f" --machines {' '.join(self.machines)}"
 
-            if len(test_bblayers) != len(self.test_layers):
-                continue
+        kas_cmd = f"shell --command \\\"{shell_cmd}\\\""
+
+        if self.network_mode:
+            network_arg = f" --network_mode=\"{self.network_mode}\""
+        else:
+            network_arg = ""
 
-            dep_bblayers = [layer for layer in bblayers
-                            if layer not in test_bblayers]
+        cmd = (f"{self.script} --project_root=\"{self.project_root}\""
+               f"{network_arg} --kas_arguments \"{kas_cmd}\" {kas_config}")
 
-            # Create the command with the dependent layers as --dependency and
-            # the test layers as positional arguments
+        return cmd
 
-            dependencies = "--dependency " + " ".join(dep_bblayers)
-            test_layers_str = " ".join(test_bblayers)
+    def run_layer_check(self, kas_config, cmd, errors, checkout_lock):
+        """ This function runs the yocto-check-layer script for the kas config
+            files via the given kas-runner.py command, and appends any
+            failures to the list of errors. The output of the command is
+            logged with a prefix identifying the kas config files, as the
+            checks of several kas configs may run concurrently.
 
-            # The yocto-check-layer-wrapper script will create a temporary
-            # directory in the parent directory of BUILDDIR
-            # So set BUILDDIR to a subidrectory of build/
-            shell_cmd = ("mkdir -p /work/kas_work_dir/build/layer_check &&"
-                         " BUILDDIR=/work/kas_work_dir/build/layer_check"
-                         " BB_NO_NETWORK=1"
-                         f" yocto-check-layer-wrapper {test_layers_str}"
-                         f" {dependencies} --no-auto-dependency")
+            Every kas command fetches and checks out the layer repositories in
+            the shared project root, so checkout_lock is held until the
+            command prints CHECKOUT_DONE_MARKER (or ends), and only the
+            yocto-check-layer scripts run concurrently. """
 
-            if self.machines:
-                shell_cmd += f" --machines {' '.join(self.machines)}"
+        self.logger.debug(f"Running layer check via: {cmd}")
 
-            kas_cmd = f"shell --command \\\"{shell_cmd}\\\""
+        released = False
 
-            if self.network_mode:
-                network_arg = f" --network_mode=\"{self.network_mode}\""
-            else:
-                network_arg = ""
+        def release_checkout():
+            nonlocal released
+            if not released:
+                released = True
+                checkout_lock.release()
 
-            cmd = (f"{self.script} --project_root=\"{self.project_root}\""
-                   f"{network_arg} --kas_arguments \"{kas_cmd}\" {kas_config}")
+        checkout_lock.acquire()
+        try:
+            self.read_layer_check_output(kas_config, cmd, errors,
+                                         release_checkout)
+        finally:
+            release_checkout()
 
-            self.logger.debug(f"Running layer check via: {cmd}")
+    def read_layer_check_output(self, kas_config, cmd, errors,
+                                release_checkout):
+        """ Run the layer check command, calling release_checkout once kas
+            has set up the layer repositories, and parse its failures into
+            the list of errors. """
 
-            process = subprocess.Popen(cmd,
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.STDOUT,
-                                       shell=True)
+        process = subprocess.Popen(cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   shell=True)
 
-            # Instead of doing some regex magic, just iterate through the
-            # output and associate any failures to the layer under test
+        # Instead of doing some regex magic, just iterate through the
+        # output and associate any failures to the layer under test
 
-            new_layer_str = "Starting to analyze: "
-            fail_str = "INFO: FAIL: "
+        new_layer_str = "Starting to analyze: "
+        fail_str = "INFO: FAIL: "
 
-            current_layer = None
-            current_failed_test = None
-            current_error = None
+        current_layer = None
+        current_failed_test = None
+        current_error = None
 
-            # If the command fails, we want to print the full output.
-            # The process.stdout is a raw stream, non-seekable BufferredReader
-            # Therefore, record the output into a prefixed list of lines, as
-            # they are read
-            output_prefix = f"\t{os.path.basename(self.script)}:"
-            output = list()
+        # If the command fails, we want to print the full output.
+        # The process.stdout is a raw stream, non-seekable BufferredReader
+        # Therefore, record the output into a prefixed list of lines, as
+        # they are read
+        output_prefix = f"\t{os.path.basename(self.script)}:"
+        output = list()
 
-            for next_line in process.stdout:
-                line = next_line.decode().strip()
+        log_prefix = "_".join(os.path.splitext(os.path.basename(path))[0]
+                              for path in kas_config.split(":"))
 
-                self.logger.debug(line)
-                output.append(line)
+        for next_line in process.stdout:
+            line = next_line.decode().strip()
 
-                if new_layer_str in line:
-                    current_layer = line.split(new_layer_str)[1]
+            self.logger.debug(f"{log_prefix}: {line}")
+            output.append(line)
 
-                elif fail_str in line:
-                    current_failed_test = line.split(fail_str)[1].split()[0]
+            if line == self.CHECKOUT_DONE_MARKER:
+                release_checkout()
 
-                elif current_failed_test is not None:
-                    if ("------------------------------" in line or
-                            "==============================" in line):
+            elif new_layer_str in line:
+                current_layer = line.split(new_layer_str)[1]
 
-                        if current_error is None:
-                            # Start the error message
-                            current_error = "\t"
-                        else:
-                            # Report the error message and reset
+            elif fail_str in line:
+                current_failed_test = line.split(fail_str)[1].split()[0]
 
-                            # To reduce the noise, remove repeat empty lines
-                            # and indent the error
-                            current_error = re.sub(r"\n\n\n+", "\n",
-                                                   current_error)
-                            current_error = current_error.replace("\n", "\n\t")
-                            current_error = current_error.rstrip()
+            elif current_failed_test is not None:
+                if ("------------------------------" in line or
+                        "==============================" in line):
 
-                            errors[kas_config].append(
-                                f"{current_layer}:FAIL {current_failed_test}")
-                            errors[kas_config].append(
-                                f"The error message was:\n{current_error}")
-                            current_failed_test = None
-                            current_error = None
+                    if current_error is None:
+                        # Start the error message
+                        current_error = "\t"
                     else:
-                        # The current line is part of the error description
-                        current_error += f"{line}\n"
+                        # Report the error message and reset
 
-            process.wait()
+                        # To reduce the noise, remove repeat empty lines
+                        # and indent the error
+                        current_error = re.sub(r"\n\n\n+", "\n",
+                                               current_error)
+                        current_error = current_error.replace("\n", "\n\t")
+                        current_error = current_error.rstrip()
 
-            if len(errors[kas_config]) == 0 and process.returncode != 0:
+                        errors.append(
+                            f"{current_layer}:FAIL {current_failed_test}")
+                        errors.append(
+                            f"The error message was:\n{current_error}")
+                        current_failed_test = None
+                        current_error = None
+                else:
+                    # The current line is part of the error description
+                    current_error += f"{line}\n"
 
-                prefixed_output = "\n".join([f"{output_prefix}{line}" for line
-                                             in output])
+        process.wait()
 
-                errors[kas_config].append(
-                    ("yocto-check-layer returned non-zero error code"
-                     f" ({process.returncode}) but no failed test was found."))
+        if len(errors) == 0 and process.returncode != 0:
+
+            prefixed_output = "\n".join([f"{output_prefix}{line}" for line
+                                         in output])
+
+            errors.append(
+                ("yocto-check-layer returned non-zero error code"
+                 f" ({process.returncode}) but no failed test was found."))
 
-                errors[kas_config].append(f"The command was: {cmd}")
+            errors.append(f"The command was: {cmd}")
 
-                errors[kas_config].append((" The output was:\n"
-                                           f"{prefixed_output}"))
+            errors.append((" The output was:\n"
+                           f"{prefixed_output}"))
+
+    def run(self):
+        """ Run the yocto-check-layer function by invoking the kas-runner.py
+            tools. The check is executed independently for each set of
+            user-defined kas config files.
+
+            If no errors are found, then report PASS.
+            If any errors are found, then report FAIL and list the layers which
+            failed, the tests that they failed on and the fail message(s). """
+
+        self.logger.info(f"Running {self.name} check, this may take a while.")
+
+        script_name = "kas-runner.py"
+        script_dir = os.path.join(os.path.dirname(__file__), "../build/")
+        self.script = common.find_executable(self.logger,
+                                             script_name,
+                                             script_dir)
+
+        if self.script is None:
+            self.logger.error("FAIL")
+            self.logger.error(f"Could not find {script_name}.")
+            return 1
+
+        # Each set of kas config files is run once, in its own build directory
+        kas_configs = list(dict.fromkeys(self.kas_configs))
+
+        errors = collections.defaultdict(list)
+        for kas_config in kas_configs:
+            errors[kas_config] = []
+
+        self.cache_layers = str(self.cache_layers).lower() in [
+            "true", "1", "yes"]
+        if self.cache_layers:
+            self.load_layers_cache()
+
+        # Resolve the layers of each build before running any checks, as kas
+        # checks out the layers into the shared project root directory
+        commands = dict()
+        for kas_config in kas_configs:
+            cmd = self.get_layer_check_command(kas_config, errors)
+            if cmd is not None:
+                commands[kas_config] = cmd
+
+        self.save_layers_cache()
+
+        jobs = int(self.jobs) or min(len(commands), os.cpu_count())
+        jobs = max(jobs, 1)
+
+        self.logger.debug((f"Running the layer check for {len(commands)} kas"
+                           f" configurations with {jobs} concurrent jobs"))
+
+        checkout_lock = threading.Lock()
+        with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+            futures = [executor.submit(self.run_layer_check, kas_config, cmd,
+                                       errors[kas_config], checkout_lock)
+                       for kas_config, cmd in commands.items()]
+            for future in futures:
+                future.result()
 
         if any(len(errs) > 0 for _, errs in errors.items()):
             self.logger.error("FAIL")
@@ -16,19 +16,42 @@ if they are not excluded by any match to the regex strings given within
 utility) that contains at least one substring in 'file_types', which should
 identify Python files.
 
+The pycodestyle library is used in-process, with a single style guide built
+from the 'pycodestyle_args' variable and reused for every file, rather than
+running a new pycodestyle interpreter for each file.
+
 On failure, the check will log any files that failed validation along with the
 reason for the error as given by pycodestyle.
 """
 
 import logging
 import os
-import re
-import subprocess
 
 import abstract_check
 import common
 
 
+def create_error_report(base_report):
+    """ Return a pycodestyle report class, derived from 'base_report', which
+        records the errors in each file as (line, column, code, message)
+        tuples rather than printing them. """
+
+    class ErrorReport(base_report):
+
+        def init_file(self, filename, lines, expected, line_offset):
+            super().init_file(filename, lines, expected, line_offset)
+            self.error_tuples = []
+
+        def error(self, line_number, offset, text, check):
+            code = super().error(line_number, offset, text, check)
+            if code:
+                self.error_tuples.append(
+                    (line_number, offset + 1, code, text[len(code) + 1:]))
+            return code
+
+    return ErrorReport
+
+
 class PythonCheck(abstract_check.AbstractCheck):
     """ Class to run the pycodestyle utility on Python scripts, to validate
         compliance with some of the style conventions in PEP 8. """
@@ -67,10 +90,11 @@ class PythonCheck(abstract_check.AbstractCheck):
             abstract_check.CheckSetting(
                 "pycodestyle_args",
                 default="",
-                message=("Custom arguments to pass through to the pycodestyle"
-                         " command. On the run-checks.py command line, set"
-                         " this parameter using '=' to avoid interpretation as"
-                         " arguments for run-checks.py.")
+                message=("Custom arguments to pass through to pycodestyle, as"
+                         " given on its command line. On the run-checks.py"
+                         " command line, set this parameter using '=' to"
+                         " avoid interpretation as arguments for"
+                         " run-checks.py.")
             )
         ]
 
@@ -78,8 +102,7 @@ class PythonCheck(abstract_check.AbstractCheck):
         self.logger = logger
         self.__dict__.update(kwargs)
 
-        self.script = "pycodestyle"
-        self.script_path = None
+        self.style_guide = None
 
         self.num_files_checked = 0
 
@@ -89,42 +112,34 @@ class PythonCheck(abstract_check.AbstractCheck):
             (respectively). """
         return ["python-magic", "pycodestyle"]
 
+    def build_style_guide(self):
+        """ Build the pycodestyle style guide from the 'pycodestyle_args'
+            variable. The project root is given as the path to check, so that
+            any project configuration file (setup.cfg or tox.ini) is read.
+            Raises SystemExit if the arguments are invalid. """
+
+        import pycodestyle
+
+        arglist = self.pycodestyle_args.split() + [self.project_root]
+
+        self.style_guide = pycodestyle.StyleGuide(
+            paths=arglist,
+            reporter=create_error_report(pycodestyle.BaseReport))
+
     def run_pycodestyle(self, path, file_errors):
-        """ Run the tool on the filepath, and return any code errors as a dict
-            mapping the filepath to the list of errors. """
-
-        command = [self.script_path, path]
-        if self.pycodestyle_args != "":
-            command += self.pycodestyle_args.split(" ")
-
-        process = subprocess.run(command,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-
-        stdout = process.stdout.decode()
-        stderr = process.stderr.decode()
-
-        # As we report the error message with a relative path from the project
-        # root, we remove the filename from the pycodestyle stdout
-        filename = os.path.basename(path)
-
-        if process.returncode != 0:
-            search_keyword = f"{filename}:"
-            errors = []
-            for line in stdout.strip().split("\n"):
-                if search_keyword not in line:
-                    # Line does not contain file name but should be
-                    # reported anyway
-                    errors.append(line)
-                else:
-                    errors.append(line.split(search_keyword)[1])
-
-            if len(errors) == 0:
-                # We failed but got no stdout, don't ignore this error!
-                errors = [f"Unknown error (rc = {process.returncode})"]
+        """ Check the file with the style guide, and add any code errors to the
+            file_errors dict, mapping the filepath to the list of errors. """
 
+        report = self.style_guide.init_report()
+        self.style_guide.input_file(path)
+
+        if report.error_tuples:
             rel_path = os.path.relpath(path, self.project_root)
-            file_errors[rel_path] = errors
+            # Errors are found in the order of the checks, so sort them by
+            # position as the pycodestyle command does
+            file_errors[rel_path] = [
+                f"{line}:{column}: {code} {message}"
+                for line, column, code, message in sorted(report.error_tuples)]
 
         self.num_files_checked += 1
 
@@ -136,11 +151,17 @@ class PythonCheck(abstract_check.AbstractCheck):
 
         self.logger.debug(f"Running {self.name} check.")
 
-        # Check if we can run the tool
-        self.script_path = common.find_executable(self.logger, self.script)
-        if self.script_path is None:
+        try:
+            self.build_style_guide()
+        except ImportError:
+            self.logger.error("FAIL")
+            self.logger.error(("Failed to import the Python pycodestyle"
+                               " module."))
+            return 1
+        except SystemExit:
             self.logger.error("FAIL")
-            self.logger.error(f"Could not find {self.script} executable")
+            self.logger.error(("Invalid pycodestyle arguments:"
+                               f" '{self.pycodestyle_args}'"))
             return 1
 
         file_errors = dict()
@@ -154,7 +175,7 @@ class PythonCheck(abstract_check.AbstractCheck):
                 continue
 
             self.logger.debug(f"Running {self.name} check on {path} using"
-                              f" {self.script} {self.pycodestyle_args}")
+                              f" pycodestyle {self.pycodestyle_args}")
             common.recursively_apply_check(
                 path,
                 self.run_pycodestyle,
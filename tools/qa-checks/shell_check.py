@@ -16,10 +16,17 @@ if they are not excluded by any match to the regex strings given within
 utility) that contains at least one substring in 'file_types', which should
 identify shell scripts only.
 
+Rather than running shellcheck once per file, the files to validate are passed
+to shellcheck in batches bounded by their total size, with the batches run in
+parallel. The JSON output of shellcheck is parsed into the findings for each
+file.
+
 On failure, the check will log any files that failed validation along with the
 reason for the error as given by shellcheck.
 """
 
+import concurrent.futures
+import json
 import logging
 import os
 import re
@@ -28,6 +35,18 @@ import subprocess
 import common
 import abstract_check
 
+# Maximum number of files passed to a single shellcheck process, so that the
+# command line stays well within the system limits
+MAX_BATCH_FILES = 100
+
+# Names used for the shellcheck severity levels, matching its "gcc" format
+SEVERITY_NAMES = {
+    "error": "error",
+    "warning": "warning",
+    "info": "note",
+    "style": "note"
+}
+
 
 class ShellCheck(abstract_check.AbstractCheck):
     """ Class to run the shellcheck static analysis tool on shell scripts, to
@@ -63,6 +82,20 @@ class ShellCheck(abstract_check.AbstractCheck):
                          " files-types (as output by the `file` utility) that"
                          " contain at least one as a substring will be"
                          " checked.")
+            ),
+            abstract_check.CheckSetting(
+                "max_batch_size",
+                default=1048576,
+                message=("Maximum total size in bytes of the files passed to"
+                         " a single shellcheck process (default: 1 MiB). A"
+                         " file larger than this is checked on its own.")
+            ),
+            abstract_check.CheckSetting(
+                "jobs",
+                default=0,
+                message=("Maximum number of shellcheck processes to run in"
+                         " parallel. If 0, the number of CPUs is used"
+                         " (default: 0).")
             )
         ]
 
@@ -73,6 +106,7 @@ class ShellCheck(abstract_check.AbstractCheck):
         self.script = "shellcheck"
         self.script_path = None
 
+        self.files = []
         self.num_files_checked = 0
 
     def get_pip_dependencies(self):
@@ -80,11 +114,43 @@ class ShellCheck(abstract_check.AbstractCheck):
             pip to find shell scripts, and run the analysis (respectively). """
         return ["python-magic", "shellcheck-py"]
 
-    def run_shellcheck(self, path, file_errors):
-        """ Run the tool on the filepath, and return any code errors as a dict
-            mapping the filepath to the list of errors. """
+    def add_file(self, path, file_errors):
+        """ Add the filepath to the list of files to pass to shellcheck. """
+
+        self.files.append(path)
+
+    def create_batches(self):
+        """ Split the files to check into batches, where each batch contains
+            at most MAX_BATCH_FILES files, and the total size of its files
+            does not exceed 'max_batch_size' unless it contains only one
+            file. """
+
+        batches = []
+        batch = []
+        batch_size = 0
+
+        for path in self.files:
+            size = os.path.getsize(path)
 
-        args = [self.script_path, "-f", "gcc", path]
+            if batch and (batch_size + size > self.max_batch_size
+                          or len(batch) >= MAX_BATCH_FILES):
+                batches.append(batch)
+                batch = []
+                batch_size = 0
+
+            batch.append(path)
+            batch_size += size
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def run_shellcheck(self, batch):
+        """ Run the tool on the batch of filepaths, and return any code errors
+            as a dict mapping each filepath to its list of errors. """
+
+        args = [self.script_path, "-f", "json1", "--"] + batch
 
         process = subprocess.run(args,
                                  stdout=subprocess.PIPE,
@@ -93,29 +159,43 @@ class ShellCheck(abstract_check.AbstractCheck):
         stdout = process.stdout.decode()
         stderr = process.stderr.decode()
 
-        # As we report the error message with a relative path from the project
-        # root, we remove the filename from the shellcheck stdout
-        filename = os.path.basename(path)
+        batch_errors = dict()
 
-        if process.returncode != 0:
-            errors = []
+        try:
+            comments = json.loads(stdout)["comments"] if stdout else []
+        except (ValueError, KeyError, TypeError):
+            comments = []
+            stderr = "\n".join([stdout, stderr])
 
-            for line in stdout.strip().split("\n"):
-                if filename not in line:
-                    # Not sure if this can happen, but if it can we should
-                    # avoid an IndexError
-                    errors.append(line)
-                else:
-                    errors.append(line.split(f"{filename}:")[1])
+        for comment in comments:
+            severity = SEVERITY_NAMES.get(comment["level"], comment["level"])
+            batch_errors.setdefault(comment["file"], []).append(
+                (f"{comment['line']}:{comment['column']}: {severity}:"
+                 f" {comment['message']} [SC{comment['code']}]"))
 
-            if len(errors) == 0:
-                # We failed but got no stdout, don't ignore this error!
-                errors = [f"Unknown error (rc = {process.returncode})"]
+        # Return codes other than 1 (findings were reported) indicate that
+        # shellcheck could not check some files, so report its error output
+        # against the files it names, or otherwise the whole batch
+        if process.returncode not in [0, 1]:
+            for line in stderr.strip().split("\n"):
+                if not line:
+                    continue
+                for path in batch:
+                    if line.startswith(f"{path}:"):
+                        batch_errors.setdefault(path, []).append(
+                            line[len(path) + 1:].strip())
+                        break
+                else:
+                    for path in batch:
+                        batch_errors.setdefault(path, []).append(line)
 
-            rel_path = os.path.relpath(path, self.project_root)
-            file_errors[rel_path] = errors
+        if process.returncode != 0 and not batch_errors:
+            # We failed but got no findings, don't ignore this error!
+            for path in batch:
+                batch_errors[path] = [
+                    f"Unknown error (rc = {process.returncode})"]
 
-        self.num_files_checked += 1
+        return batch_errors
 
     def run(self):
         """ Run the check.
@@ -145,11 +225,28 @@ class ShellCheck(abstract_check.AbstractCheck):
             self.logger.debug(f"Running {self.name} check on {path}")
             common.recursively_apply_check(
                 path,
-                self.run_shellcheck,
+                self.add_file,
                 file_errors,
                 self.exclude_patterns,
                 self.file_types)
 
+        self.max_batch_size = int(self.max_batch_size)
+        jobs = int(self.jobs) or os.cpu_count()
+        batches = self.create_batches()
+
+        self.logger.debug((f"Running {self.script} on {len(self.files)} files"
+                           f" in {len(batches)} batches"))
+
+        # Each batch is checked by a separate shellcheck process, so threads
+        # are sufficient to run them in parallel
+        with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+            for batch_errors in executor.map(self.run_shellcheck, batches):
+                for path, errors in batch_errors.items():
+                    rel_path = os.path.relpath(path, self.project_root)
+                    file_errors[rel_path] = errors
+
+        self.num_files_checked = len(self.files)
+
         if file_errors:
             self.logger.error("FAIL")
             for filename, errors in file_errors.items():
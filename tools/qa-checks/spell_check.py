@@ -16,21 +16,204 @@ non-standard English words, a file location containing a list of additional
 valid words may optionally be passed to the QA-check as the 'dict_path'
 variable.
 
+The built-in English dictionary and the custom dictionary are compiled into a
+single memory-mapped file within the QA-checks cache directory (see
+common.get_cache_dir), which is rebuilt automatically when either changes.
+
 Any files with misspelt words found by the QA-check will be logged along with
 the word itself and all of the line numbers where the invalid word was found
 within the file.
 """
 
+import array
+import bisect
 import collections
-import itertools
+import hashlib
+import mmap
 import os
 import re
-import subprocess
+import string
+import struct
 import tempfile
 
 import common
 import abstract_check
 
+# Tokens are parsed from the text in the same way as the default tokenizer of
+# the pyspellchecker package, but keeping their positions within the text
+TOKEN_REGEX = re.compile(r"(\w[\w']*\w|\w)")
+HASH_REGEX = re.compile(r"[a-f\d]{40}|[A-F\d]{40}")
+
+# Documentation regions that are not spell checked: code blocks, link
+# definitions, and the targets of internal and external links
+EXCLUSION_REGEXES = [
+    re.compile(r"(\.\. code-block::.*$)((\n +.*|\s)+)", re.M),
+    re.compile(r"(\.\.\s+_.*$)((\n +.*|\s)+)", re.M),
+    re.compile(r"`([^\s]*?)`_", re.M),
+    re.compile(r":ref:`([^\s]*?)`", re.M),
+]
+
+# Full words may join tokens with special characters, such as the file name
+# "kas-runner.py" or the script name "k3s-killall"
+FULL_WORD_CHARS = "_+-|][.'"
+FULL_WORD_REGEX = re.compile(r"[\w+\-|\]\[.']+")
+
+
+def is_full_word_char(char):
+    """ Return True if the character may form part of a full word. """
+    return char.isalnum() or char in FULL_WORD_CHARS
+
+
+class SpanIndex():
+    """ Index of character spans within a text, merged into sorted
+        non-overlapping intervals so that a position can be looked up with a
+        binary search rather than by scanning every span. """
+
+    def __init__(self, spans):
+        self.starts = list()
+        self.ends = list()
+
+        for start, end in sorted(spans):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def overlaps(self, start, end):
+        """ Return True if the span [start, end) overlaps any indexed span. """
+        idx = bisect.bisect_left(self.starts, end) - 1
+        return idx >= 0 and self.ends[idx] > start
+
+
+class CompiledDictionary():
+    """ Read-only set of valid words, loaded from a compiled dictionary file.
+
+        The file contains a header, an array of word offsets and the sorted
+        UTF-8 encoded words. It is memory-mapped rather than read, so loading
+        takes a constant time and the pages are shared between any processes
+        that load the same file. Words are looked up via a binary search.
+
+        The unknown() function matches the behavior of the function of the
+        same name provided by pyspellchecker's SpellChecker class. """
+
+    MAGIC = b"EWAOLDCT"
+    # Magic, source key digest, number of words, longest word length
+    HEADER = struct.Struct("=8s32sII")
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self.load(path)
+        except ValueError:
+            self.mm.close()
+            raise
+
+    def load(self, path):
+        """ Read the header and the word offsets, raising ValueError if the
+            file is not a complete compiled dictionary file. """
+
+        if len(self.mm) < self.HEADER.size:
+            raise ValueError(f"{path} is truncated")
+
+        header = self.HEADER.unpack_from(self.mm)
+        magic, self.key, self.num_words, self.longest_word_length = header
+
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a compiled dictionary file")
+
+        offsets_start = self.HEADER.size
+        offsets_end = offsets_start + (self.num_words + 1) * 4
+        if len(self.mm) < offsets_end:
+            raise ValueError(f"{path} is truncated")
+
+        offsets = memoryview(self.mm)[offsets_start:offsets_end].cast("I")
+        if offsets[0] != 0 or offsets_end + offsets[-1] != len(self.mm):
+            offsets.release()
+            raise ValueError(f"{path} is truncated or corrupted")
+
+        self.offsets = offsets
+        self.words_start = offsets_end
+
+    @classmethod
+    def compile(cls, path, key, words):
+        """ Write the words to a compiled dictionary file at path, identified
+            by the given 32-byte key. The file is replaced atomically so that
+            concurrent readers never see a partially written file. """
+
+        encoded = sorted({word.lower().encode() for word in words})
+
+        offsets = array.array("I", [0])
+        for word in encoded:
+            offsets.append(offsets[-1] + len(word))
+
+        longest = max((len(word) for word in encoded), default=0)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, key, len(encoded), longest))
+                offsets.tofile(f)
+                for word in encoded:
+                    f.write(word)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def close(self):
+        self.offsets.release()
+        self.mm.close()
+
+    def __len__(self):
+        return self.num_words
+
+    def __contains__(self, word):
+        target = word.encode()
+        lo = 0
+        hi = self.num_words
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.words_start + self.offsets[mid]
+            end = self.words_start + self.offsets[mid + 1]
+            candidate = self.mm[start:end]
+
+            if candidate < target:
+                lo = mid + 1
+            elif candidate > target:
+                hi = mid
+            else:
+                return True
+
+        return False
+
+    def should_check(self, word):
+        """ As pyspellchecker, ignore punctuation, numbers and words much
+            longer than any word in the dictionary. """
+
+        if len(word) == 1 and word in string.punctuation:
+            return False
+        if len(word) > self.longest_word_length + 3:
+            return False
+        if word in ("nan", "inf", "infinity"):
+            return True
+        try:
+            float(word)
+            return False
+        except ValueError:
+            pass
+
+        return True
+
+    def unknown(self, words):
+        """ Return the subset of words that are not in the dictionary. """
+        words = (word.lower() for word in words)
+        return {word for word in words
+                if self.should_check(word) and word not in self}
+
 
 class SpellCheck(abstract_check.AbstractCheck):
     """ Class to check the spelling of words in the project.
@@ -69,6 +252,14 @@ class SpellCheck(abstract_check.AbstractCheck):
                          " additional valid words when validating the spelling"
                          " of files within the project. A relative file path"
                          " will be considered relative to 'project_root'.")
+            ),
+            abstract_check.CheckSetting(
+                "max_file_size",
+                default=10485760,
+                message=("Maximum size in bytes of a file to check. Larger"
+                         " files are skipped with a warning, while binary"
+                         " files are always skipped. Set to 0 to check files"
+                         " of any size.")
             )
         ]
 
@@ -82,6 +273,114 @@ class SpellCheck(abstract_check.AbstractCheck):
         """ The pyspellchecker package is required to run the checker. """
         return ["pyspellchecker"]
 
+    def get_dictionary_key(self, spellchecker, dict_path):
+        """ Return a digest identifying the sources of the compiled dictionary:
+            the pyspellchecker version and built-in English word frequency
+            list, and the contents of the custom dictionary file. """
+
+        base_dict_path = os.path.join(os.path.dirname(spellchecker.__file__),
+                                      "resources", "en.json.gz")
+
+        digest = hashlib.sha256()
+        digest.update(getattr(spellchecker, "__version__", "").encode())
+
+        for path in [base_dict_path, dict_path]:
+            digest.update(b"\0")
+            if path is not None and os.path.isfile(path):
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+
+        return digest.digest()
+
+    def build_spellchecker(self, spellchecker, dict_path):
+        """ Return a pyspellchecker SpellChecker object using the built-in
+            English dictionary, extended with the custom dictionary. """
+
+        spellcheck = spellchecker.SpellChecker()
+
+        if dict_path is not None:
+            try:
+
+                def simple_split(text):
+                    return text.split()
+
+                spellcheck.word_frequency.load_text_file(
+                    dict_path,
+                    tokenizer=simple_split)
+
+            except UnicodeDecodeError:
+                self.logger.warning(("Could not UTF-8 decode the dictionary"
+                                     f" file at {dict_path}."))
+
+        return spellcheck
+
+    def load_dictionary(self, spellchecker, dict_path):
+        """ Load the compiled dictionary from the QA-checks cache directory,
+            first (re)compiling it if it is missing or if any of its sources
+            have changed. If the compiled dictionary cannot be used, fall back
+            to an uncompiled pyspellchecker SpellChecker object. """
+
+        key = self.get_dictionary_key(spellchecker, dict_path)
+
+        try:
+            compiled_path = os.path.join(common.get_cache_dir(self.name),
+                                         "dictionary.bin")
+
+            if os.path.isfile(compiled_path):
+                try:
+                    compiled = CompiledDictionary(compiled_path)
+                except ValueError as e:
+                    # A damaged dictionary file is compiled again below
+                    self.logger.debug(f"Ignoring the compiled dictionary: {e}")
+                else:
+                    if compiled.key == key:
+                        self.logger.debug("Loaded the compiled dictionary at"
+                                          f" {compiled_path}")
+                        return compiled
+                    compiled.close()
+
+            self.logger.debug("Compiling the dictionary into"
+                              f" {compiled_path}")
+            spellcheck = self.build_spellchecker(spellchecker, dict_path)
+            CompiledDictionary.compile(compiled_path,
+                                       key,
+                                       spellcheck.word_frequency.keys())
+
+            return CompiledDictionary(compiled_path)
+
+        except (OSError, ValueError) as e:
+            self.logger.warning("Could not use a compiled dictionary, using"
+                                f" pyspellchecker directly: {e}")
+            return self.build_spellchecker(spellchecker, dict_path)
+
+    def get_exclusions(self, path, text):
+        """ Return a SpanIndex of the character spans within the text that
+            should not be spell checked (for example, the contents of
+            documentation code blocks and link targets), along with the set of
+            words found within those spans. """
+
+        spans = list()
+        excluded_words = set()
+
+        # Currently the project has ReStructuredText formatted links within the
+        # Markdown readme
+        if path.endswith(".rst") or path.endswith(".md"):
+            for regex in EXCLUSION_REGEXES:
+                for match in regex.finditer(text):
+                    for idx, group_text in enumerate(match.groups(), 1):
+                        if group_text is None or not group_text.strip():
+                            continue
+                        spans.append(match.span(idx))
+
+                        # Words that are excluded (for example a command within
+                        # a code block) may also be referred to in the text
+                        for word in FULL_WORD_REGEX.findall(group_text):
+                            word = word.strip(FULL_WORD_CHARS).lower()
+                            excluded_words.add(word)
+                            excluded_words.update(TOKEN_REGEX.findall(word))
+
+        return SpanIndex(spans), excluded_words
+
     def run_spellcheck(self, path, file_errors):
         """ Run the spellchecker, and return any misspellings as a dict mapping
             the filepath to a list of misspelt words and their line numbers.
@@ -89,123 +388,81 @@ class SpellCheck(abstract_check.AbstractCheck):
 
         rel_path = os.path.relpath(path, self.project_root)
 
-        import spellchecker
-        word_freq = spellchecker.WordFrequency()
-        hash_regex = re.compile(r"\b([a-f\d]{40}|[A-F\d]{40})\b")
-
-        errors = set()
-
-        # Pass each line of the file through the spell checker
-        # For any detected errors, check if it is excluded from the check
-        # (for example, we don't check the contents of documentation code
-        # blocks)
+        # As code blocks may span any number of lines, the whole file is read
+        # so its size is limited by max_file_size
+        skip_reason = common.get_text_file_skip_reason(path,
+                                                       self.max_file_size)
+        if skip_reason is not None:
+            level, reason = skip_reason
+            self.logger.log(level, f"Skipping {rel_path}: {reason}")
+            return
 
         try:
             with open(path, 'r', encoding="utf-8") as f:
-                text = f.read()  # for matching
-                f.seek(0)  # to iterate over lines later
-
-                exclusions = list()
-
-                # Currently the project has ReStructuredText formatted links
-                # within the Markdown readme
-                if path.endswith(".rst") or path.endswith(".md"):
-                    # Exclude the following:
-                    code = r"(\.\. code-block::.*$)((\n +.*|\s)+)"
-                    link_defs = r"(\.\.\s+_.*$)((\n +.*|\s)+)"
-                    links_in = r"`([^\s]*?)`_"
-                    links_ex = r":ref:`([^\s]*?)`"
-
-                    matches_code = re.finditer(code, text, re.M)
-                    matches_linkdefs = re.finditer(link_defs, text, re.M)
-                    matches_links_in = re.finditer(links_in, text, re.M)
-                    matches_links_ex = re.finditer(links_ex, text, re.M)
-
-                    matches = itertools.chain(matches_code,
-                                              matches_linkdefs,
-                                              matches_links_in,
-                                              matches_links_ex)
-
-                    for _, match in enumerate(matches):
-                        for _, group_text in enumerate(match.groups()):
-                            if not group_text.strip():
-                                continue
-                            exclusions.append(group_text.strip().lower())
-
-                for line in f:
-                    if line.strip() == "":
-                        continue
-
-                    # Test the line for spelling mistakes
-                    word_freq.load_text(line.strip())
-                    words = list(self.spellcheck.unknown(word_freq.words()))
-
-                    for word in words:
-
-                        if any([word in ex for ex in exclusions]):
-                            continue
-
-                        if hash_regex.match(word):
-                            continue
-
-                        errors.add(word)
+                text = f.read()
 
         except UnicodeDecodeError as e:
             file_errors[rel_path] = [("Couldn't process file due to"
                                      " UnicodeDecodeError")]
             return
 
+        exclusions, excluded_words = self.get_exclusions(path, text)
+
+        # Tokenize the file, dropping any tokens that fall inside an excluded
+        # span, and record where each remaining token was found
+        token_positions = collections.defaultdict(list)
+        for match in TOKEN_REGEX.finditer(text):
+            if exclusions.overlaps(*match.span()):
+                continue
+            token_positions[match.group().lower()].append(match.span())
+
+        errors = [word for word in self.spellcheck.unknown(token_positions)
+                  if word not in excluded_words and
+                  not HASH_REGEX.fullmatch(word)]
+
+        # Get the positions of all the newlines in the text, so that we can
+        # determine the line number of any errors
+        newline_positions = [mat.start() for mat in re.finditer("\n", text)]
+
         # Map words to a set of lines
         errors_with_lines = collections.defaultdict(set)
 
-        # Get the full word from the token that was parsed from the line, if
+        # Get the full word from the token that was parsed from the text, if
         # necessary. This is to make the custom dictionary more understandable.
         # For example, "killall" should not be a valid word, unless it is part
         # of a reference to the "k3s-killall" script. So the latter is the only
         # word that should be considered valid.
         # In addition, get the line number(s) for the word
         for word in errors:
+            for start, end in token_positions[word]:
 
-            inc_chars = r"][[:alnum:]\+\-_|\.\'"
-            search = fr"[{inc_chars}]*{word}[{inc_chars}]*"
-            cmd = ["grep", "-inoP", search, path]
-            process = subprocess.run(cmd,
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-            stdout = process.stdout.decode().strip()
+                while start > 0 and is_full_word_char(text[start - 1]):
+                    start -= 1
+                while end < len(text) and is_full_word_char(text[end]):
+                    end += 1
 
-            if process.returncode == 0 and stdout != "":
+                # Remove any trailing special characters
+                full_word = text[start:end].strip(FULL_WORD_CHARS)
+                full_word = full_word.lower()
 
-                full_words = [(line.split(":")[0], line.split(":")[1].strip())
-                              for line in stdout.split("\n")]
-
-                full_errors = list()
-                for line_number, full_word in full_words:
-
-                    # Remove any trailing special characters
-                    full_word = full_word.strip().strip("_+-|][.'").lower()
-
-                    if any([full_word in ex for ex in exclusions]):
-                        continue
-
-                    # Check if the proper word is an actual spelling mistake /
-                    # is contained in the custom dictionary
-                    if (full_word in errors_with_lines or
-                            self.spellcheck.unknown([full_word])):
+                if (full_word in excluded_words or
+                        exclusions.overlaps(start, end)):
+                    continue
 
-                        # Merge the line numbers where it is found
-                        errors_with_lines[full_word].add(line_number)
+                # Check if the proper word is an actual spelling mistake /
+                # is contained in the custom dictionary
+                if (full_word in errors_with_lines or
+                        self.spellcheck.unknown([full_word])):
 
-            else:
-                # Couldn't find the string (this shouldn't happen)
-                # Don't discard the error
-                errors_with_lines[word].add("unknown")
+                    # Merge the line numbers where it is found
+                    line = bisect.bisect_left(newline_positions, start) + 1
+                    errors_with_lines[full_word].add(str(line))
 
         errors = list()
 
         # Report all full word errors and their line numbers
         for word, lines_set in errors_with_lines.items():
-            error_msg = f"{','.join(lines_set)}:{word}"
+            error_msg = f"{','.join(sorted(lines_set, key=int))}:{word}"
             errors.append(error_msg)
 
         if errors_with_lines:
@@ -222,12 +479,11 @@ class SpellCheck(abstract_check.AbstractCheck):
         self.logger.debug(f"Running {self.name} check.")
 
         file_errors = dict()
+        self.max_file_size = int(self.max_file_size)
 
         try:
             import spellchecker
 
-            self.spellcheck = spellchecker.SpellChecker()
-
             dict_path = self.dict_path
             if dict_path is not None:
                 if not os.path.isabs(dict_path):
@@ -236,20 +492,9 @@ class SpellCheck(abstract_check.AbstractCheck):
                 if not os.path.isfile(dict_path):
                     self.logger.warning(("Could not find the dictionary file"
                                          f" at {dict_path}."))
-                else:
-                    try:
-
-                        def simple_split(text):
-                            return text.split()
-
-                        self.spellcheck.word_frequency.load_text_file(
-                            dict_path,
-                            tokenizer=simple_split)
+                    dict_path = None
 
-                    except UnicodeDecodeError:
-                        self.logger.warning(("Could not UTF-8 decode the"
-                                             " dictionary file at"
-                                             f" {dict_path}."))
+            self.spellcheck = self.load_dictionary(spellchecker, dict_path)
 
             for path in self.paths:
 
@@ -14,14 +14,21 @@ if they are not excluded by any match to the regex strings given within
 'exclude_patterns', and are included by any match to one of the regex strings
 given within 'include_patterns'.
 
+The yamllint library is used in-process, with its configuration built once
+from the 'yamllint_args' variable and reused for every file, rather than
+running a new yamllint interpreter for each file. The files are linted one
+after another: the check already runs within a daemonic run-checks.py pool
+worker, which cannot start its own process pool, and yamllint holds the GIL
+for the whole of each file, so linting them in threads would not be faster.
+
 On failure, the check will log any files that failed validation along with the
 reason for the error as given by yamllint.
 """
 
+import argparse
 import logging
 import os
 import re
-import subprocess
 
 import abstract_check
 import common
@@ -65,10 +72,11 @@ class YamlCheck(abstract_check.AbstractCheck):
             abstract_check.CheckSetting(
                 "yamllint_args",
                 default="",
-                message=("Custom arguments to pass through to the yamllint"
-                         " command. On the run-checks.py command line, set"
-                         " this parameter using '=' to avoid interpretation as"
-                         " arguments for run-checks.py.")
+                message=("Custom arguments to pass through to yamllint, as"
+                         " given on its command line (supported: -c, -d, -f,"
+                         " -s and --no-warnings). On the run-checks.py command"
+                         " line, set this parameter using '=' to avoid"
+                         " interpretation as arguments for run-checks.py.")
             )
         ]
 
@@ -76,8 +84,9 @@ class YamlCheck(abstract_check.AbstractCheck):
         self.logger = logger
         self.__dict__.update(kwargs)
 
-        self.script = "yamllint"
-        self.script_path = None
+        self.config = None
+        self.strict = False
+        self.no_warnings = False
 
         self.num_files_checked = 0
 
@@ -86,39 +95,101 @@ class YamlCheck(abstract_check.AbstractCheck):
             validation. """
         return ["yamllint==1.26.3"]
 
+    def build_config(self):
+        """ Build the yamllint configuration from the 'yamllint_args' variable,
+            finding the configuration in the same way as the yamllint command
+            when no configuration is given in the arguments.
+            Raises SystemExit if the arguments are invalid, or
+            YamlLintConfigError if the configuration is invalid. """
+
+        from yamllint.config import YamlLintConfig
+
+        parser = argparse.ArgumentParser(prog="yamllint")
+        config_group = parser.add_mutually_exclusive_group()
+        config_group.add_argument("-c", "--config-file", dest="config_file")
+        config_group.add_argument("-d", "--config-data", dest="config_data")
+        parser.add_argument("-f", "--format")
+        parser.add_argument("-s", "--strict", action="store_true")
+        parser.add_argument("--no-warnings", action="store_true")
+
+        args = parser.parse_args(self.yamllint_args.split())
+
+        self.strict = args.strict
+        self.no_warnings = args.no_warnings
+
+        if "YAMLLINT_CONFIG_FILE" in os.environ:
+            user_global_config = os.path.expanduser(
+                os.environ["YAMLLINT_CONFIG_FILE"])
+        elif "XDG_CONFIG_HOME" in os.environ:
+            user_global_config = os.path.join(
+                os.environ["XDG_CONFIG_HOME"], "yamllint", "config")
+        else:
+            user_global_config = os.path.expanduser(
+                "~/.config/yamllint/config")
+
+        local_configs = [".yamllint", ".yamllint.yaml", ".yamllint.yml"]
+
+        if args.config_data is not None:
+            if args.config_data != "" and ":" not in args.config_data:
+                args.config_data = f"extends: {args.config_data}"
+            self.config = YamlLintConfig(content=args.config_data)
+        elif args.config_file is not None:
+            self.config = YamlLintConfig(file=args.config_file)
+        else:
+            for config_file in local_configs + [user_global_config]:
+                if os.path.isfile(config_file):
+                    self.config = YamlLintConfig(file=config_file)
+                    break
+            else:
+                self.config = YamlLintConfig("extends: default")
+
     def run_yamllint(self, path, file_errors):
-        """ Run the tool on the filepath, and return any code errors as a dict
-            mapping the filepath to the list of errors. """
+        """ Lint the file with the yamllint configuration, and add any code
+            errors to the file_errors dict, mapping the filepath to the list
+            of errors. The file fails validation if it has any errors, or any
+            warnings when running in strict mode. """
 
-        command = [self.script_path, path]
-        if self.yamllint_args != "":
-            command += self.yamllint_args.split(" ")
+        from yamllint import linter
 
-        process = subprocess.run(command,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
+        try:
+            with open(path, newline="") as f:
+                problems = list(linter.run(f, self.config, path))
+        except EnvironmentError as e:
+            problems = None
+            errors = [str(e)]
 
-        stdout = process.stdout.decode()
-        stderr = process.stderr.decode()
+        if problems is not None:
+            if self.no_warnings:
+                problems = [problem for problem in problems
+                            if problem.level == "error"]
 
-        if process.returncode != 0:
-            search_keyword = f"{path}"
             errors = []
-            for line in stdout.strip().split("\n"):
-                if search_keyword not in line:
-                    # Line does not contain file name but should be
-                    # reported anyway
-                    errors.append(line.strip())
-
-            if len(errors) == 0:
-                # We failed but got no stdout, don't ignore this error!
-                errors = [f"Unknown error (rc = {process.returncode})"]
+            if any(problem.level == "error" or self.strict
+                   for problem in problems):
+                errors = [self.format_problem(problem)
+                          for problem in problems]
 
+        if errors:
             rel_path = os.path.relpath(path, self.project_root)
             file_errors[rel_path] = errors
 
         self.num_files_checked += 1
 
+    @staticmethod
+    def format_problem(problem):
+        """ Format the problem in the same way as the standard output format of
+            the yamllint command. """
+
+        line = f"{problem.line}:{problem.column}"
+        line += max(10 - len(line), 0) * " "
+        line += problem.level
+        line += max(19 - len(line), 0) * " "
+        line += problem.desc
+        if problem.rule:
+            line += f"  ({problem.rule})"
+
+        return line
+
     def run(self):
         """ Run the YAML check.
             If no errors are found, then report PASS.
@@ -127,11 +198,23 @@ class YamlCheck(abstract_check.AbstractCheck):
 
         self.logger.debug(f"Running {self.name} check.")
 
-        # Check if we can run the tool
-        self.script_path = common.find_executable(self.logger, self.script)
-        if self.script_path is None:
+        try:
+            from yamllint.config import YamlLintConfigError
+        except ImportError:
+            self.logger.error("FAIL")
+            self.logger.error("Failed to import the Python yamllint module.")
+            return 1
+
+        try:
+            self.build_config()
+        except SystemExit:
+            self.logger.error("FAIL")
+            self.logger.error(("Invalid yamllint arguments:"
+                               f" '{self.yamllint_args}'"))
+            return 1
+        except (YamlLintConfigError, OSError) as e:
             self.logger.error("FAIL")
-            self.logger.error(f"Could not find {self.script} executable")
+            self.logger.error(f"Invalid yamllint configuration: {e}")
             return 1
 
         file_errors = dict()
@@ -145,7 +228,7 @@ class YamlCheck(abstract_check.AbstractCheck):
                 continue
 
             self.logger.debug(f"Running {self.name} check on {path} using"
-                              f" {self.script} {self.yamllint_args}")
+                              f" yamllint {self.yamllint_args}")
 
             common.recursively_apply_check(
                 path,